@@ -18,1356 +18,1834 @@ EXAMPLE
 -------
     This script can be executed on a python compiler (Powershell, any command line tool with python installed)
     python ./count_aws_resources.py --accessKey <AWS Access Key Id> --secretKey <AWS Secret Access Key>
-    
-NOTES
------
-    Copyright (c) Cloudneeti. All rights reserved.
-    Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is  furnished to do so, subject to the following conditions:
-    The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
-    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
-    Prerequisites
-        -   Workstation with Python version 3 and above, with multiprocessing and Boto3 modules installed.
-        -   User credentials (Access Key Id and Secret Accces Key) of a user having atleast the Security Audit permission and above on the AWS account
-"""
-
-import json
-import boto3
-import argparse
-import multiprocessing
-
-from urllib.request import urlopen
-
-def acm(function, credentials, resource_count, region_list):
-    print('Scanning ACM resources')
-    certificate_count = 0
-
-    for region in region_list:
-        try:
-            acm_client = boto3.client(service_name='acm', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            acm_paginator = acm_client.get_paginator('list_certificates')
-            for certifcates in acm_paginator.paginate():
-                certificate_count += len(certifcates['CertificateSummaryList'])
-        except:
-            pass
-    
-    resource_count[function] = certificate_count
-
-def apigateway(function, credentials, resource_count, region_list):
-    print('Scanning for Rest APIs')
-    api_count = 0
-
-    for region in region_list:
-        try:
-            api_client = boto3.client(service_name='apigateway', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            api_paginator = api_client.get_paginator('get_rest_apis')
-            for rest_apis in api_paginator.paginate():
-                api_count += len(rest_apis['items'])
-        except:
-            pass
-
-    resource_count[function] = api_count
-
-def apigatewayv2(function, credentials, resource_count, region_list):
-    print('Scanning for APIs')
-    apiv2_count = 0
-
-    for region in region_list:
-        try:
-            api_client = boto3.client(service_name='apigatewayv2', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            api_paginator = api_client.get_paginator('get_apis')
-            for apis in api_paginator.paginate():
-                apiv2_count += len(apis['Items'])
-        except:
-            pass
-
-    resource_count[function] = apiv2_count
-
-def asg(function, credentials, resource_count, region_list):
-    print('Scanning auto scaling resources')
-    autoscale_count = 0
-
-    for region in region_list:
-        try:
-            asg_client = boto3.client(service_name='autoscaling', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            asg_paginator = asg_client.get_paginator('describe_auto_scaling_groups')
-            for autoscale in asg_paginator.paginate():
-                autoscale_count += len(autoscale['AutoScalingGroups'])
-        except:
-            pass
-
-    resource_count[function] = autoscale_count
-
-def launch_config(function, credentials, resource_count, region_list):
-    print('Scanning Launch configurations')
-    launchconfig_count = 0
-
-    for region in region_list:
-        try:
-            asg_client = boto3.client(service_name='autoscaling', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            asg_paginator = asg_client.get_paginator('describe_launch_configurations')
-            for autoscale in asg_paginator.paginate():
-                launchconfig_count += len(autoscale['LaunchConfigurations'])
-        except:
-            pass
-
-    resource_count[function] = launchconfig_count
-
-def asg_plan(function, credentials, resource_count, region_list):
-    print('Scanning ASG plans')
-    asgplan_count = 0
-
-    for region in region_list:
-        try:
-            asg_client = boto3.client(service_name='autoscaling-plans', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            asg_paginator = asg_client.get_paginator('describe_scaling_plans')
-            for plan in asg_paginator.paginate():
-                asgplan_count += len(plan['ScalingPlans'])
-        except:
-            pass
-
-    resource_count[function] = asgplan_count
-
-def backup(function, credentials, resource_count, region_list):
-    print('Scanning for backups')
-    backup_count = 0
-
-    for region in region_list:
-        try:
-            backup_client = boto3.client(service_name='backup', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            backup_count = len(backup_client.list_backup_plans()['BackupPlansList'])
-        except:
-            pass
-    resource_count[function] = backup_count
-
-def cloudformation(function, credentials, resource_count, region_list):
-    print('Scanning for cloudformation stacks')
-    stack_count = 0
-
-    for region in region_list:
-        try:
-            cf_resource = boto3.resource('cloudformation', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            stack_count += len(list(cf_resource.stacks.all()))
-        except:
-            pass
-    resource_count[function] = stack_count
-
-def cloudfront(function, credentials, resource_count, region_list):
-    print('Scanning cloudfront resources')
-    cloudfront_count = 0
-    
-    try:
-        cloudfront_client = boto3.client(service_name='cloudfront')
-        cloudfront_paginator = cloudfront_client.get_paginator('list_distributions')
-        for distributionlist in cloudfront_paginator.paginate():
-            cloudfront_count += distributionlist['DistributionList']['Quantity']
-    except:
-        pass
-
-    resource_count[function] = cloudfront_count
-
-def cloudtrail(function, credentials, resource_count, region_list):
-    print('Scanning cloudtrail resources')
-    trail_count = 0
-
-    for region in region_list:
-        try:
-            ct_client = boto3.client('cloudtrail', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            trails = ct_client.describe_trails()
-            trail_count += len(trails['trailList'])
-        except:
-            pass
-
-    resource_count[function] = trail_count
-
-def docdb_cluster(function, credentials, resource_count, region_list):
-    print('Scanning documendb resources')
-    docdb_cluster_count= 0
-
-    for region in region_list:
-        paginated_data = []
-        try:
-            docdb_client = boto3.client(service_name='docdb', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            cluster_paginator = docdb_client.get_paginator('describe_db_clusters')
-            for clusters in cluster_paginator.paginate():
-                paginated_data.extend(clusters['DBClusters'])
-
-            for cluster_detail in paginated_data:
-                if cluster_detail['Engine'] == 'docdb':                    
-                    docdb_cluster_count += 1
-        except:
-            pass
-
-    resource_count[function] = docdb_cluster_count
-
-def docdb_instance(function, credentials, resource_count, region_list):
-    print('Scanning documendb resources')
-    docdb_instance_count = 0
-
-    for region in region_list:
-        paginated_data=[]
-        try:
-            docdb_client = boto3.client(service_name='docdb', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            instance_paginator = docdb_client.get_paginator('describe_db_instances')
-            for instances in instance_paginator.paginate():
-                paginated_data.extend(instances['DBInstances'])
-
-            for instance_detail in paginated_data:
-                if instance_detail['Engine'] == 'docdb':
-                    docdb_instance_count += 1
-        except:
-            pass
-
-    resource_count[function] = docdb_instance_count
-
-def dynamodb(function, credentials, resource_count, region_list):
-    print('Scanning dynamodb resources')
-    dynamodb_table_count = 0
-
-    for region in region_list:
-        try:
-            dynamodb_client = boto3.resource(service_name='dynamodb', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            table_iterator = dynamodb_client.tables.all()
-            dynamodb_table_count += len(list(table_iterator))
-        except:
-            pass
-
-    resource_count[function] = dynamodb_table_count
-
-def dax(function, credentials, resource_count, region_list):
-    print('Scanning dax resources')
-    dax_count = 0
-
-    for region in region_list:
-        try:
-            dax_client = boto3.client(service_name='dax', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            cluster_paginator = dax_client.get_paginator('describe_clusters')
-            for clusters in cluster_paginator.paginate():
-                dax_count += len(clusters['Clusters'])
-        except:
-            pass
-
-    resource_count[function] = dax_count
-
-def ec2_ami(function, credentials, resource_count, region_list):
-    print('Scanning ec2 AMIs')
-    ec2_image_count = 0
-
-    for region in region_list:
-        try:
-            ec2 = boto3.resource('ec2', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            ec2_image_count += len(list(ec2.images.filter(Owners=[credentials['account_id']])))
-        except:
-            pass
-
-    resource_count[function] = ec2_image_count
-
-def ec2_instances(function, credentials, resource_count, region_list):
-    print('Scanning ec2 instances')
-    ec2_instance_count = 0
-
-    for region in region_list:
-        try:
-            ec2 = boto3.resource('ec2', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)    
-            ec2_instance_count += len(list(ec2.instances.all()))
-        except:
-            pass
-
-    resource_count[function] = ec2_instance_count
-
-def ec2_sg(function, credentials, resource_count, region_list):
-    print('Scanning ec2 security groups')
-    security_group_count = 0
-
-    for region in region_list:
-        try:
-            ec2 = boto3.resource('ec2', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            security_group_count += len(list(ec2.security_groups.all()))
-        except:
-            pass
-
-    resource_count[function] = security_group_count
-
-def vpc(function, credentials, resource_count, region_list):
-    print('Scanning VPCs')
-    vpc_count = 0
-
-    for region in region_list:
-        try:
-            vpc_client = boto3.resource('ec2', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            vpc_count += len(list(vpc_client.vpcs.all()))
-        except:
-            pass
 
-    resource_count[function] = vpc_count
+    The scan is split into (collector, region) work units that run on a bounded thread pool:
+    python ./count_aws_resources.py --accessKey <AWS Access Key Id> --secretKey <AWS Secret Access Key> --workers 64
 
-def subnet(function, credentials, resource_count, region_list):
-    print('Scanning Subnets')
-    subnet_count = 0
+    Use --engine process to scan each collector as a task on a pool of --processes processes instead, or --engine asyncio
+    to run every paginated call on a single event loop (requires aiobotocore, install using: pip install aiobotocore):
+    python ./count_aws_resources.py --accessKey <AWS Access Key Id> --secretKey <AWS Secret Access Key> --engine asyncio --maxInFlight 200
 
-    for region in region_list:
-        try:
-            ec2_client = boto3.resource('ec2', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            subnet_count += len(list(ec2_client.subnets.all()))
-        except:
-            pass
-
-    resource_count[function] = subnet_count
-
-def route_table(function, credentials, resource_count, region_list):
-    print('Scanning Route Tables')
-    routetable_count = 0
+    Any resource type Cloud Control can list is counted by naming its CloudFormation type, with no service specific code.
+    Named types are added to Total Resources; none are counted this way unless given:
+    python ./count_aws_resources.py --accessKey <AWS Access Key Id> --secretKey <AWS Secret Access Key> --cloudControlTypes AWS::Glue::Job AWS::SSM::Document
 
-    for region in region_list:
-        try:
-            ec2_client = boto3.resource('ec2', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            routetable_count += len(list(ec2_client.route_tables.all()))
-        except:
-            pass
-
-    resource_count[function] = routetable_count
+    Totals that a service reports in one call (IAM account summary, Lambda account settings, Auto Scaling account limits,
+    Route 53 hosted zone count) are read instead of listing every item. Use --detail to list every item anyway:
+    python ./count_aws_resources.py --accessKey <AWS Access Key Id> --secretKey <AWS Secret Access Key> --detail
 
-def igw(function, credentials, resource_count, region_list):
-    print('Scanning IGWs')
-    igw_count = 0
+    Use --streamCounts to count the items of EC2, ELB, RDS and other XML API responses as they stream in, instead of
+    parsing each page into objects first (thread and process engines):
+    python ./count_aws_resources.py --accessKey <AWS Access Key Id> --secretKey <AWS Secret Access Key> --streamCounts
 
-    for region in region_list:
-        try:
-            ec2_client = boto3.resource('ec2', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            igw_count += len(list(ec2_client.internet_gateways.all()))
-        except:
-            pass
+    Use --tag to count only the resources carrying a tag, straight from the Resource Groups Tagging API in every region:
+    python ./count_aws_resources.py --accessKey <AWS Access Key Id> --secretKey <AWS Secret Access Key> --tag Owner=payments
 
-    resource_count[function] = igw_count
+    Use --organization with management account credentials to count every active member account in one run. A role is
+    assumed into each account and all of their work units share the --workers pool, with at most --accountWorkers units
+    of any one account in flight. Counts are shown per account and rolled up for the organization:
+    python ./count_aws_resources.py --accessKey <AWS Access Key Id> --secretKey <AWS Secret Access Key> --organization --roleName OrganizationAccountAccessRole
 
-def nacl(function, credentials, resource_count, region_list):
-    print('Scanning NACLs')
-    nacl_count = 0
+    Use --engine hybrid for large scans where parsing responses keeps one core busy: it runs --processes worker processes
+    (one per core by default), each with its own pool of --workers threads, and shards accounts across them:
+    python ./count_aws_resources.py --accessKey <AWS Access Key Id> --secretKey <AWS Secret Access Key> --organization --engine hybrid --workers 16
 
-    for region in region_list:
-        try:
-            ec2_client = boto3.resource('ec2', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            nacl_count += len(list(ec2_client.network_acls.all()))
-        except:
-            pass
-
-    resource_count[function] = nacl_count
-
-def placement_group(function, credentials, resource_count, region_list):
-    print('Scanning Placement Groups')
-    pg_count = 0
-
-    for region in region_list:
-        try:
-            ec2_client = boto3.resource('ec2', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            pg_count += len(list(ec2_client.placement_groups.all()))
-        except:
-            pass
+    Use --coordinator to spread a scan across hosts. The coordinator writes every work unit to a SQLite queue file on
+    storage all hosts can reach, then waits and reports; any number of workers, on any host, lease units from it and
+    write their counts back. Workers assume --roleName into member accounts with their own credentials:
+    python ./count_aws_resources.py --accessKey <AWS Access Key Id> --secretKey <AWS Secret Access Key> --organization --coordinator /shared/scan.db
+    python ./count_aws_resources.py --accessKey <AWS Access Key Id> --secretKey <AWS Secret Access Key> --worker /shared/scan.db
 
-    resource_count[function] = pg_count
+    Use --source config to read counts from AWS Config in one call per region wherever a configuration recorder is
+    recording; resource types and regions Config does not record are still counted through the service APIs:
+    python ./count_aws_resources.py --accessKey <AWS Access Key Id> --secretKey <AWS Secret Access Key> --source config
 
-def network_interface(function, credentials, resource_count, region_list):
-    print('Scanning NICs')
-    nic_count = 0
-
-    for region in region_list:
-        try:
-            ec2_client = boto3.resource('ec2', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            nic_count += len(list(ec2_client.network_interfaces.all()))
-        except:
-            pass
-
-    resource_count[function] = nic_count
-
-def ebs(function, credentials, resource_count, region_list):
-    print('Scanning EBS Volumes')
-    ebs_count = 0
-
-    for region in region_list:
-        try:
-            ec2_client = boto3.resource('ec2', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            ebs_count += len(list(ec2_client.volumes.all()))
-        except:
-            pass
-
-    resource_count[function] = ebs_count
-
-def ebs_snapshots(function, credentials, resource_count, region_list):
-    print('Scanning EBS Snapshots')
-    snapshot_count = 0
-
-    for region in region_list:
-        try:
-            ec2_client = boto3.resource('ec2', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            snapshot_count += len(list(ec2_client.snapshots.filter(OwnerIds=[credentials['account_id']])))
-        except:
-            pass
+    Use --source resource-explorer to take per type totals from a Resource Explorer aggregator index with a few searches;
+    regions without an index and types Resource Explorer does not index are still counted through the service APIs:
+    python ./count_aws_resources.py --accessKey <AWS Access Key Id> --secretKey <AWS Secret Access Key> --source resource-explorer
 
-    resource_count[function] = snapshot_count
+    Use --source usage-metrics to read the AWS/Usage ResourceCount metrics of each region in one GetMetricData request;
+    types without a published metric are still counted through the service APIs:
+    python ./count_aws_resources.py --accessKey <AWS Access Key Id> --secretKey <AWS Secret Access Key> --source usage-metrics
 
-def reserved_instances(function, credentials, resource_count, region_list):
-    print('Scanning EC2 reserved instances')
-    ri_count = 0
+    Use --source aggregator to count every account and region an AWS Config aggregator collects (for example one created
+    with ../aws-config-onboarding/config-aggregator.yml) through a single grouped advanced query:
+    python ./count_aws_resources.py --accessKey <AWS Access Key Id> --secretKey <AWS Secret Access Key> --source aggregator --aggregatorName <Aggregator Name>
 
-    for region in region_list:
-        try:
-            ec2_client = boto3.client('ec2', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            ri_count += len(ec2_client.describe_reserved_instances()['ReservedInstances'])
-        except:
-            pass
-
-    resource_count[function] = ri_count
-
-def ecr(function, credentials, resource_count, region_list):
-    print('Scanning ECR resources')
-    ecr_count = 0
-
-    for region in region_list:
-        try:
-            ecr_client = boto3.client(service_name='ecr', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            ecr_paginator = ecr_client.get_paginator('describe_repositories')            
-            for ecr in ecr_paginator.paginate():
-                ecr_count += len(list(ecr['repositories']))
-        except:
-            pass
-    
-    resource_count[function] = ecr_count
-
-def ecs(function, credentials, resource_count, region_list):
-    print('Scanning ECS resources')
-    ecs_count = 0
-
-    for region in region_list:
-        try:
-            ecs_client = boto3.client(service_name='ecs', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            ecs_paginator = ecs_client.get_paginator('list_clusters')            
-            for ecs in ecs_paginator.paginate():
-                ecs_count += len(list(ecs['clusterArns']))
-        except:
-            pass
-    
-    resource_count[function] = ecs_count
-
-def efs(function, credentials, resource_count, region_list):
-    print('Scanning EFS resources')
-    efs_count = 0
-
-    for region in region_list:
-        try:
-            efs_client = boto3.client(service_name='efs', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            efs_paginator = efs_client.get_paginator('describe_file_systems')            
-            for efs in efs_paginator.paginate():
-                efs_count += len(list(efs['FileSystems']))
-        except:
-            pass
-    
-    resource_count[function] = efs_count
-
-def eks(function, credentials, resource_count, region_list):
-    print('Scanning EKS resources')
-    eks_count = 0
-
-    for region in region_list:
-        try:
-            eks_client = boto3.client(service_name='eks', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            eks_paginator = eks_client.get_paginator('list_clusters')            
-            for eks in eks_paginator.paginate():
-                eks_count += len(list(eks['clusters']))
-        except:
-            pass
-    
-    resource_count[function] = eks_count
-
-def elasticache(function, credentials, resource_count, region_list):
-    print('Scanning ElastiCache resources')
-    memcache_count = 0
-
-    for region in region_list:
-        try:
-            ec_client = boto3.client(service_name='elasticache', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)            
-            mem_paginator = ec_client.get_paginator('describe_cache_clusters')            
-            for mem_cache in mem_paginator.paginate():
-                memcache_count += len(list(mem_cache['CacheClusters']))
-        except:
-            pass
-    
-    resource_count[function] = memcache_count
-
-def replication_group(function, credentials, resource_count, region_list):
-    print('Scanning ElastiRedisCache resources')
-    rg_count = 0
-
-    for region in region_list:
-        try:
-            ec_client = boto3.client(service_name='elasticache', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)            
-            redis_paginator = ec_client.get_paginator('describe_replication_groups')            
-            for redis_cache in redis_paginator.paginate():
-                rg_count += len(list(redis_cache['ReplicationGroups']))
-        except:
-            pass
-    
-    resource_count[function] = rg_count
-
-def elasticsearch(function, credentials, resource_count, region_list):
-    print('Scanning ElasticSearch resources')
-    esdomain_count = 0
-
-    for region in region_list:
-        try:
-            es_client = boto3.client(service_name='es', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            es_list = es_client.list_domain_names()            
-            esdomain_count += len(es_list['DomainNames'])
-        except:
-            pass
-    
-    resource_count[function] = esdomain_count
-
-def elb(function, credentials, resource_count, region_list):
-    print('Scanning load balancer resources')
-    elb_count = 0
-
-    for region in region_list:
-        try:
-            elb = boto3.client('elb', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            elb_paginator = elb.get_paginator('describe_load_balancers')
-            for balancer in elb_paginator.paginate():
-                elb_count += len(balancer['LoadBalancerDescriptions'])
-        except:
-            pass
-
-    resource_count[function] = elb_count
-
-def elbv2(function, credentials, resource_count, region_list):
-    print('Scanning load balancer v2 resources')
-    elbv2_count = 0
-
-    for region in region_list:
-        try:
-            elb = boto3.client('elbv2', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            elb_paginator = elb.get_paginator('describe_load_balancers')
-            for balancer in elb_paginator.paginate():
-                elbv2_count += len(balancer['LoadBalancers'])
-        except:
-            pass
-
-    resource_count[function] = elbv2_count
-
-def fsx(function, credentials, resource_count, region_list):
-    print('Scanning FSx resources')
-    fsx_count = 0
-
-    for region in region_list:
-        try:
-            fsx_client = boto3.client(service_name='fsx', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            fsx_paginator = fsx_client.get_paginator('describe_file_systems')            
-            for fsx in fsx_paginator.paginate():
-                fsx_count += len(list(fsx['FileSystems']))
-        except:
-            pass
+    Credentials can also come from a named profile, temporary keys with --sessionToken, or the default credential chain
+    when no keys are given. Use --roleArn to count the account of a role assumed first; assumed role credentials are
+    cached under --credentialCacheDir and reused by later runs until shortly before they expire:
+    python ./count_aws_resources.py --profile <Profile Name> --roleArn arn:aws:iam::<Account Id>:role/<Role Name>
 
-    resource_count[function] = fsx_count
+NOTES
+-----
+    Copyright (c) Cloudneeti. All rights reserved.
+    Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is  furnished to do so, subject to the following conditions:
+    The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+    Prerequisites
+        -   Workstation with Python version 3 and above, with Boto3 module installed.
+        -   User credentials (Access Key Id and Secret Accces Key) of a user having atleast the Security Audit permission and above on the AWS account, or a profile or role with the same permission
+"""
 
-def emr(function, credentials, resource_count, region_list):
-    print('Scanning EMR resources')
-    emr_cluster_count = 0
+import os
+import re
+import json
+import time
+import boto3
+import asyncio
+import argparse
+import contextlib
+import random
+import socket
+import sqlite3
+import hashlib
+import importlib.util
+import datetime
+import jmespath
+import threading
+import xml.etree.ElementTree as ElementTree
+
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import create_request_object, prepare_request_dict
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectionClosedError, ConnectTimeoutError, EndpointConnectionError, ReadTimeoutError
+from botocore.loaders import create_loader
+from botocore.parsers import create_parser
+from botocore.serialize import create_serializer
+from collections import Counter, deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
+from urllib.request import urlopen
 
-    for region in region_list:
-        try:
-            emr_client = boto3.client(service_name='emr', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            clusters = emr_client.get_paginator('list_clusters')            
-            for cluster in clusters.paginate():
-                emr_cluster_count += len(list(cluster['Clusters']))
-        except:
-            pass
-
-    resource_count[function] = emr_cluster_count
-
-def iam_user(function, credentials, resource_count, region_list):
-    print('Scanning IAM Users')
-    iam_user_count = 0
-    
+# Global services are counted once, from this region, instead of once per enabled region
+GLOBAL_REGION = 'us-east-1'
+
+# Clients are shared by every collector of a service in a region, so their pools must hold more than the default 10 connections.
+# Adaptive retries add client-side rate limiting on top of botocore's jittered backoff when a region starts throttling.
+CLIENT_CONFIG = Config(max_pool_connections=50, retries={'mode': 'adaptive', 'max_attempts': 4})
+
+# Failures are classified so a region that could not be counted is reported instead of silently counted as 0
+THROTTLING_ERRORS = {'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException', 'TooManyRequestsException',
+                     'ProvisionedThroughputExceededException', 'RequestLimitExceeded', 'RequestThrottled', 'SlowDown', 'PriorRequestNotComplete',
+                     'BandwidthLimitExceeded', 'EC2ThrottledException'}
+ACCESS_DENIED_ERRORS = {'AccessDenied', 'AccessDeniedException', 'UnauthorizedOperation', 'UnauthorizedException', 'AuthorizationError',
+                        'AuthorizationErrorException', 'Forbidden', 'ForbiddenException'}
+REGION_NOT_OPTED_IN_ERRORS = {'OptInRequired', 'InvalidClientTokenId', 'UnrecognizedClientException', 'AuthFailure', 'SubscriptionRequiredException'}
+ENDPOINT_UNAVAILABLE_ERRORS = {'ServiceUnavailable', 'ServiceUnavailableException', 'InternalError', 'InternalFailure', 'InternalServerError',
+                               'InternalServerErrorException', 'RequestTimeout', 'RequestTimeoutException'}
+ENDPOINT_UNAVAILABLE_EXCEPTIONS = (EndpointConnectionError, ConnectTimeoutError, ReadTimeoutError, ConnectionClosedError)
+RETRYABLE_ERRORS = ('throttling', 'endpoint-unavailable')
+
+# Errors that mean there is nothing to count, rather than that counting failed. Cloud Control reports a resource type
+# that is not offered in a region as not found.
+NOT_IN_USE_ERRORS = {'AWSOrganizationsNotInUseException', 'TypeNotFoundException'}
+
+# Retries beyond botocore's own are spread with full jitter and drawn from a budget shared by the whole scan,
+# so a region that keeps failing cannot stall every worker
+retry_settings = { 'max_attempts': 3, 'base_delay': 1.0, 'max_delay': 20.0, 'budget': 200 }
+retry_budget_lock = threading.Lock()
+
+Failure = namedtuple('Failure', ['collector', 'region', 'category', 'message'])
+
+# A collector calls a single list/describe operation and counts the items found under result_key (a JMESPath
+# expression) on every page of the response. Items count towards the collector's only resource type, unless a
+# classify function is given, which maps each item to one of resource_types (or None to skip it). page_size asks
+# paginated calls for that many items per page (the API maximum) instead of the service default.
+Collector = namedtuple('Collector', ['name', 'resource_types', 'service', 'operation', 'result_key', 'params', 'classify', 'is_global', 'page_size'])
+
+def collector(name, resource_types, service, operation, result_key, params=None, classify=None, is_global=False, page_size=None):
+    if isinstance(resource_types, str):
+        resource_types = (resource_types,)
+    # Server side filters from SERVER_SIDE_FILTERS are part of the collector's params, so every engine sends them
+    params = dict(params or {}, **SERVER_SIDE_FILTERS.get(name, {}))
+    return Collector(name, tuple(resource_types), service, operation, result_key, params, classify, is_global, page_size)
+
+def totals_key(container, fields):
+    # JMESPath that maps each resource type to the total a service reports for it, e.g. SummaryMap.{"AWS::IAM::User": Users}
+    return '{}.{{{}}}'.format(container, ', '.join('"{}": {}'.format(resource_type, field) for resource_type, field in fields.items()))
+
+# Largest MaxResults accepted by the EC2 describe calls (describe_route_tables is capped lower). Other collectors pass
+# their own API maximum inline.
+EC2_MAX_RESULTS = 1000
+EC2_ROUTE_TABLE_MAX_RESULTS = 100
+
+# list_stacks is far lighter than describe_stacks; this filter keeps it to the stacks describe_stacks would return
+ACTIVE_STACK_STATUSES = ['CREATE_IN_PROGRESS', 'CREATE_FAILED', 'CREATE_COMPLETE', 'ROLLBACK_IN_PROGRESS', 'ROLLBACK_FAILED', 'ROLLBACK_COMPLETE',
+                         'DELETE_IN_PROGRESS', 'DELETE_FAILED', 'UPDATE_IN_PROGRESS', 'UPDATE_COMPLETE_CLEANUP_IN_PROGRESS', 'UPDATE_COMPLETE',
+                         'UPDATE_FAILED', 'UPDATE_ROLLBACK_IN_PROGRESS', 'UPDATE_ROLLBACK_FAILED', 'UPDATE_ROLLBACK_COMPLETE_CLEANUP_IN_PROGRESS',
+                         'UPDATE_ROLLBACK_COMPLETE', 'REVIEW_IN_PROGRESS', 'IMPORT_IN_PROGRESS', 'IMPORT_COMPLETE', 'IMPORT_ROLLBACK_IN_PROGRESS',
+                         'IMPORT_ROLLBACK_FAILED', 'IMPORT_ROLLBACK_COMPLETE']
+
+def classify_kms_alias(alias):
+    if 'alias/aws/' not in alias['AliasName']:
+        return 'AWS::KMS::Key'
+
+# RDS, DocumentDB and Neptune share the RDS control plane, so one pass over describe_db_clusters and
+# describe_db_instances per region fills every engine's counter. Clusters are looked up by (Engine, EngineMode),
+# falling back to (Engine, None) for engines whose mode does not matter.
+AURORA_PROVISIONED_MODES = ('provisioned', 'parallelquery', 'multimaster')
+
+RDS_CLUSTER_TYPES = {
+    ('docdb', None): 'AWS::DocDB::DBCluster',
+    ('neptune', None): 'AWS::Neptune::DBCluster',
+    ('aurora', 'serverless'): 'AWS::RDS::DBCluster::AuroraMySql',
+    ('aurora-postgresql', 'serverless'): 'AWS::RDS::DBCluster::AuroraPostgres',
+}
+for engine in ('aurora', 'aurora-postgresql'):
+    for mode in AURORA_PROVISIONED_MODES:
+        RDS_CLUSTER_TYPES[(engine, mode)] = 'AWS::RDS::DBCluster::Aurora'
+
+RDS_INSTANCE_TYPES = {
+    'docdb': 'AWS::DocDB::DBInstance',
+    'neptune': 'AWS::Neptune::DBInstance',
+    'aurora': 'AWS::RDS::DBInstance::Aurora',
+    'aurora-postgresql': 'AWS::RDS::DBInstance::Aurora',
+    'mariadb': 'AWS::RDS::DBInstance::MariaDB',
+    'mysql': 'AWS::RDS::DBInstance::MySql',
+    'oracle-se': 'AWS::RDS::DBInstance::Oracle',
+    'oracle-ee': 'AWS::RDS::DBInstance::Oracle',
+    'oracle-se1': 'AWS::RDS::DBInstance::Oracle',
+    'oracle-se2': 'AWS::RDS::DBInstance::Oracle',
+    'postgres': 'AWS::RDS::DBInstance::Postgres',
+    'sqlserver-ex': 'AWS::RDS::DBInstance::SQLServer',
+    'sqlserver-se': 'AWS::RDS::DBInstance::SQLServer',
+    'sqlserver-web': 'AWS::RDS::DBInstance::SQLServer',
+    'sqlserver-ee': 'AWS::RDS::DBInstance::SQLServer',
+}
+
+def classify_rds_cluster(cluster):
+    engine = cluster.get('Engine')
+    return RDS_CLUSTER_TYPES.get((engine, cluster.get('EngineMode'))) or RDS_CLUSTER_TYPES.get((engine, None))
+
+def classify_rds_instance(instance):
+    return RDS_INSTANCE_TYPES.get(instance.get('Engine'))
+
+def unique(values):
+    return tuple(dict.fromkeys(values))
+
+# EMR keeps terminated clusters listed for two months; only clusters in these states are counted
+ACTIVE_EMR_CLUSTER_STATES = ['STARTING', 'BOOTSTRAPPING', 'RUNNING', 'WAITING', 'TERMINATING']
+
+# Filters the services apply before responding, keyed by collector name, so items the count would discard never cross
+# the wire. The RDS engine filters only return databases the classify functions count.
+SERVER_SIDE_FILTERS = {
+    'cloudformation': {'StackStatusFilter': ACTIVE_STACK_STATUSES},
+    'rds_clusters': {'Filters': [{'Name': 'engine', 'Values': list(unique(engine for engine, _ in RDS_CLUSTER_TYPES))}]},
+    'rds_instances': {'Filters': [{'Name': 'engine', 'Values': list(RDS_INSTANCE_TYPES)}]},
+    'ec2_ami': {'Owners': ['self']},
+    'ebs_snapshots': {'OwnerIds': ['self']},
+    'iam_policy': {'Scope': 'Local'},
+    'emr': {'ClusterStates': ACTIVE_EMR_CLUSTER_STATES},
+    'rds_snapshot': {'SnapshotType': 'manual'},
+    'alarms': {'AlarmTypes': ['MetricAlarm']},
+}
+
+COLLECTORS = [
+    collector('lambdas', 'AWS::Lambda::Function', 'lambda', 'list_functions', 'Functions'),
+    collector('acm', 'AWS::CertificateManager::Certificate', 'acm', 'list_certificates', 'CertificateSummaryList'),
+    collector('apigateway', 'AWS::ApiGateway::RestApi', 'apigateway', 'get_rest_apis', 'items'),
+    collector('apigatewayv2', 'AWS::ApiGatewayV2::Api', 'apigatewayv2', 'get_apis', 'Items'),
+    collector('asg', 'AWS::AutoScaling::AutoScalingGroup', 'autoscaling', 'describe_auto_scaling_groups', 'AutoScalingGroups'),
+    collector('launch_config', 'AWS::AutoScaling::LaunchConfiguration', 'autoscaling', 'describe_launch_configurations', 'LaunchConfigurations'),
+    collector('asg_plan', 'AWS::AutoScalingPlans::ScalingPlan', 'autoscaling-plans', 'describe_scaling_plans', 'ScalingPlans'),
+    collector('backup', 'AWS::Backup::BackupPlan', 'backup', 'list_backup_plans', 'BackupPlansList'),
+    collector('cloudformation', 'AWS::CloudFormation::Stack', 'cloudformation', 'list_stacks', 'StackSummaries'),
+    collector('cloudfront', 'AWS::CloudFront::Distribution', 'cloudfront', 'list_distributions', 'DistributionList.Quantity', is_global=True),
+    collector('cloudtrail', 'AWS::CloudTrail::Trail', 'cloudtrail', 'describe_trails', 'trailList'),
+    collector('rds_clusters', unique(RDS_CLUSTER_TYPES.values()), 'rds', 'describe_db_clusters', 'DBClusters', classify=classify_rds_cluster),
+    collector('rds_instances', unique(RDS_INSTANCE_TYPES.values()), 'rds', 'describe_db_instances', 'DBInstances', classify=classify_rds_instance),
+    collector('dynamodb', 'AWS::DynamoDB::Table', 'dynamodb', 'list_tables', 'TableNames', page_size=100),
+    collector('dax', 'AWS::DAX::Cluster', 'dax', 'describe_clusters', 'Clusters'),
+    collector('ec2_ami', 'AWS::EC2::AMI', 'ec2', 'describe_images', 'Images', page_size=EC2_MAX_RESULTS),
+    collector('ec2_instances', 'AWS::EC2::Instance', 'ec2', 'describe_instances', 'Reservations[].Instances[]', page_size=EC2_MAX_RESULTS),
+    collector('ec2_sg', 'AWS::EC2::SecurityGroup', 'ec2', 'describe_security_groups', 'SecurityGroups', page_size=EC2_MAX_RESULTS),
+    collector('vpc', 'AWS::EC2::VPC', 'ec2', 'describe_vpcs', 'Vpcs', page_size=EC2_MAX_RESULTS),
+    collector('subnet', 'AWS::EC2::Subnet', 'ec2', 'describe_subnets', 'Subnets', page_size=EC2_MAX_RESULTS),
+    collector('route_table', 'AWS::EC2::RouteTable', 'ec2', 'describe_route_tables', 'RouteTables', page_size=EC2_ROUTE_TABLE_MAX_RESULTS),
+    collector('igw', 'AWS::EC2::InternetGateway', 'ec2', 'describe_internet_gateways', 'InternetGateways', page_size=EC2_MAX_RESULTS),
+    collector('nacl', 'AWS::EC2::NetworkAcl', 'ec2', 'describe_network_acls', 'NetworkAcls', page_size=EC2_MAX_RESULTS),
+    collector('placement_group', 'AWS::EC2::PlacementGroup', 'ec2', 'describe_placement_groups', 'PlacementGroups'),
+    collector('network_interface', 'AWS::EC2::NetworkInterface', 'ec2', 'describe_network_interfaces', 'NetworkInterfaces', page_size=EC2_MAX_RESULTS),
+    collector('ebs', 'AWS::EC2::Volume', 'ec2', 'describe_volumes', 'Volumes', page_size=EC2_MAX_RESULTS),
+    collector('ebs_snapshots', 'AWS::EC2::EBSSnapshot', 'ec2', 'describe_snapshots', 'Snapshots', page_size=EC2_MAX_RESULTS),
+    collector('reserved_instances', 'AWS::EC2::CapacityReservation', 'ec2', 'describe_reserved_instances', 'ReservedInstances'),
+    collector('ecr', 'AWS::ECR::Repository', 'ecr', 'describe_repositories', 'repositories'),
+    collector('ecs', 'AWS::ECS::Cluster', 'ecs', 'list_clusters', 'clusterArns'),
+    collector('efs', 'AWS::EFS::FileSystem', 'efs', 'describe_file_systems', 'FileSystems'),
+    collector('eks', 'AWS::EKS::Cluster', 'eks', 'list_clusters', 'clusters'),
+    collector('elasticache', 'AWS::ElastiCache::CacheCluster', 'elasticache', 'describe_cache_clusters', 'CacheClusters'),
+    collector('replication_group', 'AWS::ElastiCache::ReplicationGroup', 'elasticache', 'describe_replication_groups', 'ReplicationGroups'),
+    collector('elasticsearch', 'AWS::Elasticsearch::Domain', 'es', 'list_domain_names', 'DomainNames'),
+    collector('elb', 'AWS::ElasticLoadBalancing::LoadBalancer', 'elb', 'describe_load_balancers', 'LoadBalancerDescriptions'),
+    collector('elbv2', 'AWS::ElasticLoadBalancingV2::LoadBalancer', 'elbv2', 'describe_load_balancers', 'LoadBalancers'),
+    collector('fsx', 'AWS::FSx::FileSystem', 'fsx', 'describe_file_systems', 'FileSystems'),
+    collector('iam_user', 'AWS::IAM::User', 'iam', 'list_users', 'Users', is_global=True, page_size=1000),
+    collector('iam_group', 'AWS::IAM::Group', 'iam', 'list_groups', 'Groups', is_global=True, page_size=1000),
+    collector('iam_roles', 'AWS::IAM::Role', 'iam', 'list_roles', 'Roles', is_global=True, page_size=1000),
+    collector('iam_policy', 'AWS::IAM::Policy', 'iam', 'list_policies', 'Policies', is_global=True, page_size=1000),
+    collector('iam_certificate', 'AWS::IAM::ServerCertificate', 'iam', 'list_server_certificates', 'ServerCertificateMetadataList', is_global=True, page_size=1000),
+    collector('emr', 'AWS::EMR::Cluster', 'emr', 'list_clusters', 'Clusters'),
+    collector('kms', 'AWS::KMS::Key', 'kms', 'list_aliases', 'Aliases', classify=classify_kms_alias),
+    collector('kinesis', 'AWS::Kinesis::Stream', 'kinesis', 'list_streams', 'StreamNames'),
+    collector('firehose', 'AWS::KinesisFirehose::DeliveryStream', 'firehose', 'list_delivery_streams', 'DeliveryStreamNames', params={'Limit': 100}),
+    collector('rds_reserved_instance', 'AWS::RDS::ReservedInstance', 'rds', 'describe_reserved_db_instances', 'ReservedDBInstances'),
+    collector('rds_snapshot', 'AWS::RDS::Snapshot', 'rds', 'describe_db_snapshots', 'DBSnapshots'),
+    collector('redshift', 'AWS::Redshift::Cluster', 'redshift', 'describe_clusters', 'Clusters'),
+    collector('redshift_reserved', 'AWS::Redshift::ReservedNode', 'redshift', 'describe_reserved_nodes', 'ReservedNodes'),
+    collector('route53', 'AWS::Route53::HostedZone', 'route53', 'list_hosted_zones', 'HostedZones', is_global=True),
+    collector('route53domain', 'AWS::Route53::Domain', 'route53domains', 'list_domains', 'Domains', is_global=True),
+    collector('s3bucket', 'AWS::S3::Bucket', 's3', 'list_buckets', 'Buckets', is_global=True, page_size=10000),
+    collector('ses', 'AWS::SES', 'ses', 'list_identities', 'Identities'),
+    collector('simpledb', 'AWS::SDB::Domain', 'sdb', 'list_domains', 'DomainNames'),
+    collector('sns', 'AWS::SNS::Topic', 'sns', 'list_topics', 'Topics'),
+    collector('sqs', 'AWS::SQS::Queue', 'sqs', 'list_queues', 'QueueUrls', page_size=1000),
+    collector('log_group', 'AWS::Logs::LogGroup', 'logs', 'describe_log_groups', 'logGroups'),
+    collector('alarms', 'AWS::CloudWatch::Alarm', 'cloudwatch', 'describe_alarms', 'MetricAlarms', page_size=100),
+    collector('organization', 'AWS::Organization', 'organizations', 'describe_organization', 'Organization', is_global=True),
+    collector('elastic_beanstalk', 'AWS::ElasticBeanstalk::Application', 'elasticbeanstalk', 'describe_applications', 'Applications'),
+    collector('lightsail_instance', 'AWS::Lightsail::Instance', 'lightsail', 'get_instances', 'instances'),
+    collector('lightsail_lb', 'AWS::Lightsail::LoadBalancer', 'lightsail', 'get_load_balancers', 'loadBalancers'),
+    collector('lightsail_rds', 'AWS::Lightsail::RDS', 'lightsail', 'get_relational_databases', 'relationalDatabases'),
+    collector('codecommit', 'AWS::CodeCommit::Repository', 'codecommit', 'list_repositories', 'repositories'),
+    collector('codedeploy', 'AWS::CodeDeploy::Application', 'codedeploy', 'list_applications', 'applications'),
+    collector('codepipeline', 'AWS::CodePipeline::Pipeline', 'codepipeline', 'list_pipelines', 'pipelines'),
+]
+
+# Cloud Control lists resources of any type by its CloudFormation type name, so the types below (and any given with
+# --cloudControlTypes) are counted without a service specific collector. Each (type, region) is an ordinary work unit on
+# whichever engine runs the scan. None are listed by default, so Total Resources covers the same types as before.
+CLOUD_CONTROL_MAX_RESULTS = 100
+CLOUD_CONTROL_TYPES = []
+
+def cloud_control_collector(type_name):
+    return collector(type_name, type_name, 'cloudcontrol', 'list_resources', 'ResourceDescriptions', params={'TypeName': type_name}, page_size=CLOUD_CONTROL_MAX_RESULTS)
+
+COLLECTORS += [cloud_control_collector(type_name) for type_name in CLOUD_CONTROL_TYPES]
+
+# get_account_summary reports these IAM totals in one call. Policies counts customer managed policies only,
+# matching list_policies with Scope=Local.
+IAM_SUMMARY_FIELDS = {
+    'AWS::IAM::User': 'Users',
+    'AWS::IAM::Group': 'Groups',
+    'AWS::IAM::Role': 'Roles',
+    'AWS::IAM::Policy': 'Policies',
+    'AWS::IAM::ServerCertificate': 'ServerCertificates',
+}
+
+AUTOSCALING_LIMIT_FIELDS = {
+    'AWS::AutoScaling::AutoScalingGroup': 'NumberOfAutoScalingGroups',
+    'AWS::AutoScaling::LaunchConfiguration': 'NumberOfLaunchConfigurations',
+}
+
+# Single call count sources and the listing collectors each one replaces. They are used unless --detail asks for every
+# item to be listed, and only when all the collectors they replace are part of the scan.
+COUNT_ONLY_COLLECTORS = [
+    (('iam_user', 'iam_group', 'iam_roles', 'iam_policy', 'iam_certificate'),
+     collector('iam_summary', IAM_SUMMARY_FIELDS, 'iam', 'get_account_summary', totals_key('SummaryMap', IAM_SUMMARY_FIELDS), is_global=True)),
+    (('lambdas',),
+     collector('lambda_settings', 'AWS::Lambda::Function', 'lambda', 'get_account_settings', 'AccountUsage.FunctionCount')),
+    (('asg', 'launch_config'),
+     collector('autoscaling_limits', AUTOSCALING_LIMIT_FIELDS, 'autoscaling', 'describe_account_limits', totals_key('@', AUTOSCALING_LIMIT_FIELDS))),
+    (('route53',),
+     collector('route53_count', 'AWS::Route53::HostedZone', 'route53', 'get_hosted_zone_count', 'HostedZoneCount', is_global=True)),
+]
+
+def count_only_collectors(collectors):
+    names = {collector.name for collector in collectors}
+    replacements = {}
+    for replaced, count_collector in COUNT_ONLY_COLLECTORS:
+        if set(replaced) <= names:
+            replacements[replaced[0]] = count_collector
+            replacements.update((name, None) for name in replaced[1:])
+
+    selected = []
+    for collector in collectors:
+        replacement = replacements.get(collector.name, collector)
+        if replacement is not None:
+            selected.append(replacement)
+    return selected
+
+def count_items(collector, page):
+    items = jmespath.search(collector.result_key, page)
+    if items is None:
+        return Counter()
+    # Some responses carry a ready-made total (CloudFront), totals per resource type (see totals_key) or a single
+    # object (Organizations)
+    if isinstance(items, int):
+        return Counter({collector.resource_types[0]: items})
+    if isinstance(items, dict) and set(items) <= set(collector.resource_types):
+        return Counter({resource_type: total for resource_type, total in items.items() if total})
+    if isinstance(items, dict):
+        items = [items]
+    if collector.classify is None:
+        return Counter({collector.resource_types[0]: len(items)})
+    return Counter(resource_type for resource_type in map(collector.classify, items) if resource_type)
+
+# Sessions and clients are built once per (account, service, region) and reused for the whole scan.
+# boto3 sessions are not thread safe, so client creation is serialized; calls on the clients are not.
+session_cache = {}
+client_cache = {}
+client_cache_lock = threading.Lock()
+
+def create_session(access_key=None, secret_key=None, session_token=None, profile=None):
+    # Every session is built here: static keys with an optional session token, a named profile, or the default
+    # provider chain (environment, shared config, container and instance roles) when neither is given
+    if access_key:
+        return boto3.session.Session(aws_access_key_id=access_key, aws_secret_access_key=secret_key, aws_session_token=session_token)
+    return boto3.session.Session(profile_name=profile)
+
+def session_credentials(session, account_id):
+    # Credentials are resolved once into plain values, which every engine can hand to its workers
+    resolved = session.get_credentials()
+    if resolved is None:
+        return None
+    frozen = resolved.get_frozen_credentials()
+    return { 'access_key': frozen.access_key, 'secret_key': frozen.secret_key, 'session_token': frozen.token, 'account_id': account_id }
+
+def get_session(credentials):
+    # Keyed by access key as well, so refreshed role credentials get a new session instead of the expired one
+    key = (credentials['account_id'], credentials['access_key'])
+    if key not in session_cache:
+        session_cache[key] = create_session(credentials['access_key'], credentials['secret_key'], credentials.get('session_token'))
+    return session_cache[key]
+
+def get_client(credentials, service, region):
+    key = (credentials['account_id'], credentials['access_key'], service, region)
+    client = client_cache.get(key)
+    if client is None:
+        with client_cache_lock:
+            client = client_cache.get(key)
+            if client is None:
+                client = get_session(credentials).client(service, region_name=region, config=CLIENT_CONFIG)
+                client_cache[key] = client
+    return client
+
+# Assumed role credentials are cached on disk, one file per (source credentials, role, external id), and reused by later
+# and parallel runs while more than half of their lifetime is left. A scan that outlives them assumes the role again
+# CREDENTIAL_REFRESH_MARGIN seconds before they expire.
+CREDENTIAL_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'count_aws_resources', 'credentials')
+CREDENTIAL_REFRESH_MARGIN = 300
+ROLE_SESSION_NAME = 'count-aws-resources'
+
+credential_settings = { 'cache_dir': CREDENTIAL_CACHE_DIR }
+
+renewed_credentials = {}
+renewed_credentials_lock = threading.RLock()
+
+def credentials_expiring(credentials):
+    return time.time() > credentials.get('expiration', float('inf')) - CREDENTIAL_REFRESH_MARGIN
+
+def credentials_reusable(credentials):
+    lifetime = credentials['expiration'] - credentials['assumed_at']
+    return time.time() < credentials['expiration'] - lifetime / 2
+
+def credential_cache_file(session, role_arn, external_id):
+    source_key = session.get_credentials().get_frozen_credentials().access_key
+    digest = hashlib.sha256(json.dumps([source_key, role_arn, external_id]).encode()).hexdigest()
+    return os.path.join(credential_settings['cache_dir'], digest + '.json')
+
+def load_cached_credentials(cache_file):
     try:
-        iam = boto3.resource('iam')
-        iam_user_count = len(list(iam.users.all()))
-    except:
-        pass
-
-    resource_count[function] = iam_user_count
+        with open(cache_file) as f:
+            credentials = json.load(f)
+        return credentials if credentials_reusable(credentials) else None
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
 
-def iam_group(function, credentials, resource_count, region_list):
-    print('Scanning IAM Groups')
-    iam_group_count = 0
-    
+def save_cached_credentials(cache_file, credentials):
     try:
-        iam = boto3.resource('iam')
-        iam_group_count = len(list(iam.groups.all()))
-    except:
-        pass
-
-    resource_count[function] = iam_group_count
-
-def iam_roles(function, credentials, resource_count, region_list):
-    print('Scanning IAM roles')
-    iam_role_count = 0
-    
+        os.makedirs(os.path.dirname(cache_file), mode=0o700, exist_ok=True)
+        temp_file = '{}.{}.{}.tmp'.format(cache_file, os.getpid(), threading.get_ident())
+        # Readable by the owner only, the file holds live credentials
+        with os.fdopen(os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            json.dump(credentials, f)
+        os.replace(temp_file, cache_file)
+    except OSError:
+        print("Unable to write credential cache to", cache_file)
+
+def assume_role(session, role_arn, external_id=None):
+    # The returned credentials carry the role and the source credentials, so renew_credentials can assume it again.
+    # The source credentials are never written to the cache.
+    source = session_credentials(session, None)
+    cache_file = credential_cache_file(session, role_arn, external_id) if credential_settings['cache_dir'] else None
+    credentials = load_cached_credentials(cache_file) if cache_file else None
+    if credentials:
+        return dict(credentials, source=source)
+
+    params = {'RoleArn': role_arn, 'RoleSessionName': ROLE_SESSION_NAME}
+    if external_id:
+        params['ExternalId'] = external_id
+    role_credentials = session.client('sts', config=CLIENT_CONFIG).assume_role(**params)['Credentials']
+    credentials = { 'access_key': role_credentials['AccessKeyId'], 'secret_key': role_credentials['SecretAccessKey'],
+                    'session_token': role_credentials['SessionToken'], 'account_id': role_arn.split(':')[4],
+                    'role_arn': role_arn, 'external_id': external_id, 'assumed_at': time.time(),
+                    'expiration': role_credentials['Expiration'].timestamp() }
+    if cache_file:
+        save_cached_credentials(cache_file, credentials)
+    return dict(credentials, source=source)
+
+def renew_credentials(credentials):
+    # Units of a long scan check their credentials before each attempt, and the first one to find them expiring assumes
+    # the role again (renewing the source first, for chained roles) while the others wait and share the result
+    if 'role_arn' not in credentials or not credentials_expiring(credentials):
+        return credentials
+    key = (credentials['role_arn'], credentials['external_id'], credentials['source']['access_key'])
+    with renewed_credentials_lock:
+        renewed = renewed_credentials.get(key)
+        if renewed is None or credentials_expiring(renewed):
+            source = renew_credentials(credentials['source'])
+            renewed = renewed_credentials[key] = assume_role(get_session(source), credentials['role_arn'], credentials['external_id'])
+    return renewed
+
+def pagination_config(page_size):
+    return {'PageSize': page_size} if page_size else {}
+
+def fetch_pages(client, operation, params, page_size=None):
+    if client.can_paginate(operation):
+        return client.get_paginator(operation).paginate(PaginationConfig=pagination_config(page_size), **params)
+    return [getattr(client, operation)(**params)]
+
+def get_pages(credentials, collector, region):
+    # Every collector makes its own call, so pages are counted as they arrive and never held in memory
+    client = get_client(credentials, collector.service, region)
+    return fetch_pages(client, collector.operation, collector.params, collector.page_size)
+
+# With --streamCounts, list calls of XML (ec2 and query protocol) services are sent as raw signed requests and their
+# response bodies are streamed through iterparse, counting list items and reading the next token without botocore
+# building a dict for every item. Only collectors that count whole pages (no classify, a plain result_key) qualify.
+stream_settings = { 'enabled': False }
+STREAMING_PROTOCOLS = ('ec2', 'query')
+
+StreamPlan = namedtuple('StreamPlan', ['operation_model', 'list_path', 'item_name', 'token_path', 'input_token', 'limit_key'])
+
+stream_plans = {}
+stream_plans_lock = threading.Lock()
+stream_loader = create_loader()
+
+# Streamed pages bypass the client's retry handler, so throttled and failed pages are retried here as often as a client
+# would retry them, before the error counts against the scan-wide retry budget
+STREAM_MAX_ATTEMPTS = CLIENT_CONFIG.retries['max_attempts'] + 1
+STREAM_RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+STREAM_CONNECTION_ERRORS = (ConnectionClosedError, ConnectTimeoutError, EndpointConnectionError, ReadTimeoutError)
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+def serialized_name(shape, member):
+    return shape.members[member].serialization.get('name', member)
+
+def build_stream_plan(client, collector):
+    service_model = client.meta.service_model
+    operation_model = service_model.operation_model(client.meta.method_to_api_mapping[collector.operation])
+    output_shape = operation_model.output_shape
+    list_shape = output_shape.members.get(collector.result_key) if output_shape else None
+    if (service_model.protocol not in STREAMING_PROTOCOLS or collector.classify
+            or list_shape is None or list_shape.type_name != 'list' or list_shape.serialization.get('flattened')):
+        return None
+
+    # ec2 responses hold their members directly under the root, query responses inside an <Operation>Result wrapper
+    prefix = [operation_model.output_shape.serialization['resultWrapper']] if 'resultWrapper' in output_shape.serialization else []
+    pagination = stream_loader.load_service_model(service_model.service_name, 'paginators-1', service_model.api_version)
+    paginator = pagination.get('pagination', {}).get(operation_model.name)
+    if paginator is None:
+        return StreamPlan(operation_model, prefix + [serialized_name(output_shape, collector.result_key)],
+                          list_shape.member.serialization.get('name', 'member'), None, None, None)
+    if not all(isinstance(paginator.get(key), str) and paginator[key] in members
+               for key, members in (('output_token', output_shape.members), ('input_token', operation_model.input_shape.members))):
+        return None
+    return StreamPlan(operation_model, prefix + [serialized_name(output_shape, collector.result_key)],
+                      list_shape.member.serialization.get('name', 'member'),
+                      prefix + [serialized_name(output_shape, paginator['output_token'])], paginator['input_token'], paginator.get('limit_key'))
+
+def get_stream_plan(client, collector):
+    key = (collector.service, collector.name)
+    with stream_plans_lock:
+        if key not in stream_plans:
+            stream_plans[key] = build_stream_plan(client, collector)
+        return stream_plans[key]
+
+def send_streaming_request(credentials, client, plan, params):
+    # Requests go through the client's own HTTP session, so its proxies, CA bundle, client certificate, timeouts and
+    # connection pool apply to streamed pages as well
+    http_session = client._endpoint.http_session
+    frozen_credentials = get_session(credentials).get_credentials().get_frozen_credentials()
+    attempt = 0
+    while True:
+        attempt += 1
+        # Signed again on every attempt, since the signature covers the request time
+        request_dict = create_serializer(client.meta.service_model.protocol).serialize_to_request(params, plan.operation_model)
+        prepare_request_dict(request_dict, client.meta.endpoint_url)
+        request = create_request_object(request_dict)
+        request.stream_output = True
+        SigV4Auth(frozen_credentials, client.meta.service_model.signing_name, client.meta.region_name).add_auth(request)
+        try:
+            response = http_session.send(request.prepare())
+        except STREAM_CONNECTION_ERRORS:
+            if attempt >= STREAM_MAX_ATTEMPTS:
+                raise
+            time.sleep(backoff_delay(attempt))
+            continue
+        if response.status_code < 300:
+            return response.raw
+
+        error = create_parser(client.meta.service_model.protocol).parse(
+            {'status_code': response.status_code, 'headers': response.headers, 'body': response.content}, plan.operation_model.output_shape)
+        retryable = response.status_code in STREAM_RETRYABLE_STATUS or error.get('Error', {}).get('Code') in THROTTLING_ERRORS
+        if not retryable or attempt >= STREAM_MAX_ATTEMPTS:
+            raise ClientError(error, plan.operation_model.name)
+        time.sleep(backoff_delay(attempt))
+
+def count_streamed_page(body, plan):
+    # Paths are matched below the response root, so nested lists that reuse the item name are not counted. Every
+    # element is detached from its parent once read, so memory stays flat however long the page is.
+    items = 0
+    next_token = None
+    path = []
+    elements = []
+    for event, element in ElementTree.iterparse(body, events=('start', 'end')):
+        if event == 'start':
+            path.append(local_name(element.tag))
+            elements.append(element)
+            continue
+        if path[1:-1] == plan.list_path and path[-1] == plan.item_name:
+            items += 1
+        elif plan.token_path and path[1:] == plan.token_path:
+            next_token = element.text
+        path.pop()
+        elements.pop()
+        if elements:
+            elements[-1].remove(element)
+    return items, next_token
+
+def count_streamed(credentials, client, collector, plan):
+    params = dict(collector.params)
+    if plan.limit_key and collector.page_size:
+        params[plan.limit_key] = collector.page_size
+    items = 0
+    while True:
+        body = send_streaming_request(credentials, client, plan, params)
+        try:
+            page_items, next_token = count_streamed_page(body, plan)
+        finally:
+            body.release_conn()
+        items += page_items
+        if not next_token:
+            return Counter({collector.resource_types[0]: items})
+        params[plan.input_token] = next_token
+
+def count_resources(credentials, collector, region):
+    if stream_settings['enabled']:
+        client = get_client(credentials, collector.service, region)
+        plan = get_stream_plan(client, collector)
+        if plan:
+            return count_streamed(credentials, client, collector, plan)
+
+    resource_count = Counter()
+    for page in get_pages(credentials, collector, region):
+        resource_count.update(count_items(collector, page))
+    return resource_count
+
+def classify_error(error):
+    if isinstance(error, ClientError):
+        code = error.response.get('Error', {}).get('Code', '')
+        if code in NOT_IN_USE_ERRORS:
+            return None
+        if code in THROTTLING_ERRORS:
+            return 'throttling'
+        if code in ACCESS_DENIED_ERRORS:
+            return 'access-denied'
+        if code in REGION_NOT_OPTED_IN_ERRORS:
+            return 'region-not-opted-in'
+        if code in ENDPOINT_UNAVAILABLE_ERRORS:
+            return 'endpoint-unavailable'
+        return 'unexpected'
+    if isinstance(error, ENDPOINT_UNAVAILABLE_EXCEPTIONS):
+        return 'endpoint-unavailable'
+    return 'unexpected'
+
+def take_retry(category, attempt):
+    if category not in RETRYABLE_ERRORS or attempt >= retry_settings['max_attempts']:
+        return False
+    with retry_budget_lock:
+        if retry_settings['budget'] <= 0:
+            return False
+        retry_settings['budget'] -= 1
+    return True
+
+def backoff_delay(attempt):
+    return random.uniform(0, min(retry_settings['max_delay'], retry_settings['base_delay'] * 2 ** attempt))
+
+def scan_unit(credentials, collector, region):
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            credentials = renew_credentials(credentials)
+            return count_resources(credentials, collector, region), None
+        except Exception as e:
+            category = classify_error(e)
+            if category is None:
+                return Counter(), None
+            if not take_retry(category, attempt):
+                return Counter(), Failure(collector.name, region, category, ' '.join(str(e).split()))
+        time.sleep(backoff_delay(attempt))
+
+def get_enabled_regions(session):
+    # Regions that are not opted in reject every call, so they are dropped before any work is planned
+    ec2_client = session.client('ec2', region_name=GLOBAL_REGION)
+    regions = ec2_client.describe_regions(AllRegions=True)['Regions']
+    return [region['RegionName'] for region in regions if region.get('OptInStatus') in ('opt-in-not-required', 'opted-in')]
+
+# Enabled regions rarely change, so they are cached on disk per account and region discovery is skipped on repeated runs
+REGION_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'count_aws_resources', 'regions.json')
+
+region_cache_lock = threading.Lock()
+
+def load_region_cache(cache_file):
     try:
-        iam = boto3.resource('iam')
-        iam_role_count = len(list(iam.roles.all()))
-    except:
-        pass
-
-    resource_count[function] = iam_role_count
+        with open(cache_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
-def iam_policy(function, credentials, resource_count, region_list):
-    print('Scanning IAM policies')
-    iam_policy_count = 0
-    
+def save_region_cache(cache_file, region_cache):
     try:
-        iam = boto3.resource('iam')
-        iam_policy_count = len(list(iam.policies.filter(Scope='Local')))
-    except:
-        pass
-
-    resource_count[function] = iam_policy_count
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        # Written to a temporary file first, so parallel runs never read a half-written cache
+        temp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+        with open(temp_file, 'w') as f:
+            json.dump(region_cache, f)
+        os.replace(temp_file, cache_file)
+    except OSError:
+        print("Unable to write region cache to", cache_file)
+
+def get_cached_enabled_regions(session, account_id, cache_file, ttl, refresh):
+    region_cache = load_region_cache(cache_file)
+    cached = region_cache.get(account_id)
+    if cached and not refresh and time.time() - cached['updated'] < ttl:
+        print("Using enabled regions cached at", time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(cached['updated'])))
+        return cached['regions']
+
+    regions = get_enabled_regions(session)
+    if ttl > 0:
+        # Accounts of an organization scan are planned concurrently, so the cache is re-read under the lock before saving
+        with region_cache_lock:
+            region_cache = load_region_cache(cache_file)
+            region_cache[account_id] = { 'regions': regions, 'updated': time.time() }
+            save_region_cache(cache_file, region_cache)
+    return regions
+
+def plan_service_regions(session, collectors, region_list):
+    # botocore's bundled endpoint data lists the regions each service is offered in; a service with no
+    # endpoint data is planned for every enabled region rather than dropped
+    service_regions = {}
+    for collector in collectors:
+        if collector.is_global or collector.service in service_regions:
+            continue
+        available_regions = set(session.get_available_regions(collector.service))
+        if available_regions:
+            service_regions[collector.service] = [region for region in region_list if region in available_regions]
+        else:
+            service_regions[collector.service] = list(region_list)
+    return service_regions
+
+def build_work_units(collectors, service_regions):
+    units = []
+    for collector in collectors:
+        regions = [GLOBAL_REGION] if collector.is_global else service_regions[collector.service]
+        for region in regions:
+            units.append((collector, region))
+    return units
+
+def worker_settings(processes):
+    # Plain values handed to worker processes once, each process getting an equal share of the retry budget
+    return { 'retry': dict(retry_settings, budget=retry_settings['budget'] // processes), 'stream': dict(stream_settings),
+             'credential': dict(credential_settings) }
+
+def apply_worker_settings(settings):
+    # Runs in a worker process, which does not share the parent's settings when it is spawned rather than forked
+    retry_settings.update(settings['retry'])
+    stream_settings.update(settings['stream'])
+    credential_settings.update(settings['credential'])
+
+def scan_collector(collector, credentials, regions, settings):
+    apply_worker_settings(settings)
+    print('Scanning {} resources'.format(collector.name))
+    resource_count = Counter()
+    failures = []
+    for region in regions:
+        unit_count, failure = scan_unit(credentials, collector, region)
+        resource_count.update(unit_count)
+        if failure:
+            failures.append(failure)
+    return resource_count, failures
+
+def run_process_engine(credentials, units, processes):
+    # Credentials and settings are plain values pickled into each task, and each task returns its counts and failures,
+    # so nothing inside a worker calls back to the parent process. Units are grouped by name, as a collector holding a
+    # params dict is not hashable.
+    collector_regions = {}
+    for collector, region in units:
+        collector_regions.setdefault(collector.name, (collector, []))[1].append(region)
+
+    resource_count = Counter()
+    failures = []
+    if not collector_regions:
+        return resource_count, failures
+    processes = min(len(collector_regions), processes)
+    settings = worker_settings(processes)
 
-def iam_certificate(function, credentials, resource_count, region_list):
-    print('Scanning IAM certificates')
-    iam_certificate_count = 0
-    
     try:
-        iam = boto3.resource('iam')
-        iam_certificate_count = len(list(iam.server_certificates.all()))
-    except:
-        pass
-
-    resource_count[function] = iam_certificate_count
-
-def kms(function, credentials, resource_count, region_list):
-    print('Scanning KMS resources')
-    key_count = 0
-
-    for region in region_list:
-        paginated_data=[]
-        try:
-            kms_client = boto3.client(service_name='kms', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            kms_paginator = kms_client.get_paginator('list_aliases')
-            for keys in kms_paginator.paginate():
-                paginated_data.extend(keys['Aliases'])
-        
-            for KMS_Detail in paginated_data:
-                if 'alias/aws/' not in KMS_Detail['AliasName']:
-                    key_count += 1
-        except:
-            pass
-
-    resource_count[function] = key_count
-
-def kinesis(function, credentials, resource_count, region_list):
-    print('Scanning Kinesis resources')
-    stream_count = 0
-
-    for region in region_list:
-        try:
-            kinesis_client = boto3.client(service_name='kinesis', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            streams = kinesis_client.get_paginator('list_streams')            
-            for stream in streams.paginate():
-                stream_count += len(stream['StreamNames'])
-        except:
-            pass
-
-    resource_count[function] = stream_count
-
-def firehose(function, credentials, resource_count, region_list):
-    print('Scanning Kinesis resources')
-    firehose_count = 0
-
-    for region in region_list:
-        try:
-            firehose_client = boto3.client(service_name='firehose', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            firehose_count += len(firehose_client.list_delivery_streams(Limit=100)['DeliveryStreamNames'])
-        except:
-            pass
-
-    resource_count[function] = firehose_count
-
-def lambdas(function, credentials, resource_count, region_list):
-    print('Scanning Lambda resources')
-    lambda_count = 0
-
-    for region in region_list:
-        try:
-            lambda_client = boto3.client(service_name='lambda', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            lambda_paginator = lambda_client.get_paginator('list_functions')            
-            for func in lambda_paginator.paginate():
-                lambda_count += len(list(func['Functions']))
-        except:
-            pass
-
-    resource_count[function] = lambda_count
-
-def neptune_cluster(function, credentials, resource_count, region_list):
-    print('Scanning Neptune resources')
-    neptune_cluster_count = 0
-
-    for region in region_list:
-        paginated_data=[]
-        try:
-            neptune_client = boto3.client(service_name='neptune', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            clusters = neptune_client.get_paginator('describe_db_clusters')            
-            for cluster in clusters.paginate():
-                paginated_data.extend(cluster['DBClusters'])
-
-            for NeptuneDetail in paginated_data:
-                if 'neptune' in NeptuneDetail['Engine']:
-                    neptune_cluster_count+=1
-        except:
-            pass
-
-    resource_count[function] = neptune_cluster_count
-
-def neptune_instance(function, credentials, resource_count, region_list):
-    print('Scanning Neptune resources')
-    neptune_instance_count = 0
-
-    for region in region_list:
-        paginated_data=[]
-        try:
-            neptune_client = boto3.client(service_name='neptune', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            instances = neptune_client.get_paginator('describe_db_instances')
-            for instance in instances.paginate():
-                paginated_data.extend(instance['DBInstances'])
-            
-            for NeptuneDetail in paginated_data:
-                if 'neptune' in NeptuneDetail['Engine']:
-                    neptune_instance_count+=1
-        except:
-            pass
-
-    resource_count[function] = neptune_instance_count
-
-def rds_aurora_cluster(function, credentials, resource_count, region_list):
-    print('Scanning RDS resources')
-    cluster_count = 0
-
-    for region in region_list:
-        paginated_data=[]
-        try:
-            rds_client = boto3.client(service_name='rds', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)            
-            clusters = rds_client.get_paginator('describe_db_clusters')            
-            for cluster in clusters.paginate():
-                paginated_data.extend(cluster['DBClusters'])
-
-            for RDS_Detail in paginated_data:
-                if (RDS_Detail['Engine'] == 'aurora-postgresql' or RDS_Detail['Engine'] == 'aurora') and (RDS_Detail['EngineMode'] == 'provisioned' or RDS_Detail['EngineMode'] == 'parallelquery' or RDS_Detail['EngineMode'] == 'multimaster'):
-                    cluster_count += 1
-        except:
-            pass
-
-    resource_count[function] = cluster_count
-
-def rds_auroramysql_cluster(function, credentials, resource_count, region_list):
-    print('Scanning RDS resources')
-    cluster_count = 0
-
-    for region in region_list:
-        paginated_data=[]
-        try:
-            rds_client = boto3.client(service_name='rds', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)            
-            clusters = rds_client.get_paginator('describe_db_clusters')            
-            for cluster in clusters.paginate():
-                paginated_data.extend(cluster['DBClusters'])
-
-            for RDS_Detail in paginated_data:
-                if RDS_Detail['Engine'] == 'aurora' and RDS_Detail['EngineMode'] == 'serverless':
-                    cluster_count += 1
-        except:
-            pass
-
-    resource_count[function] = cluster_count
-
-def rds_aurorapostgres_cluster(function, credentials, resource_count, region_list):
-    print('Scanning RDS resources')
-    cluster_count = 0
-
-    for region in region_list:
-        paginated_data=[]
-        try:
-            rds_client = boto3.client(service_name='rds', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)            
-            clusters = rds_client.get_paginator('describe_db_clusters')            
-            for cluster in clusters.paginate():
-                paginated_data.extend(cluster['DBClusters'])
-
-            for RDS_Detail in paginated_data:
-                if RDS_Detail['Engine'] == 'aurora-postgresql' and RDS_Detail['EngineMode'] == 'serverless':
-                    cluster_count += 1
-        except:
-            pass
-
-    resource_count[function] = cluster_count
-
-def rds_aurora_instance(function, credentials, resource_count, region_list):
-    print('Scanning RDS resources')
-    rds_instance_count = 0
-
-    for region in region_list:
-        paginated_data=[]
-        try:
-            rds_client = boto3.client(service_name='rds', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            instances = rds_client.get_paginator('describe_db_instances')
-            for instance in instances.paginate():
-                paginated_data.extend(instance['DBInstances'])
-                
-            for RDS_Detail in paginated_data:
-                if RDS_Detail['Engine'] == 'aurora-postgresql' or RDS_Detail['Engine'] == 'aurora':
-                    rds_instance_count += 1
-        except:
-            pass
-
-    resource_count[function] = rds_instance_count
-
-def rds_mariadb_instance(function, credentials, resource_count, region_list):
-    print('Scanning RDS resources')
-    rds_instance_count = 0
-
-    for region in region_list:
-        paginated_data=[]
-        try:
-            rds_client = boto3.client(service_name='rds', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            instances = rds_client.get_paginator('describe_db_instances')
-            for instance in instances.paginate():
-                paginated_data.extend(instance['DBInstances'])
-                
-            for RDS_Detail in paginated_data:
-                if RDS_Detail['Engine'] == 'mariadb':
-                    rds_instance_count += 1
-        except:
-            pass
-
-    resource_count[function] = rds_instance_count
-
-def rds_mysql_instance(function, credentials, resource_count, region_list):
-    print('Scanning RDS resources')
-    rds_instance_count = 0
-
-    for region in region_list:
-        paginated_data=[]
-        try:
-            rds_client = boto3.client(service_name='rds', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            instances = rds_client.get_paginator('describe_db_instances')
-            for instance in instances.paginate():
-                paginated_data.extend(instance['DBInstances'])
-                
-            for RDS_Detail in paginated_data:
-                if RDS_Detail['Engine'] == 'mysql':
-                    rds_instance_count += 1
-        except:
-            pass
-
-    resource_count[function] = rds_instance_count
-
-def rds_oracle_instance(function, credentials, resource_count, region_list):
-    print('Scanning RDS resources')
-    rds_instance_count = 0
-
-    for region in region_list:
-        paginated_data=[]
-        try:
-            rds_client = boto3.client(service_name='rds', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            instances = rds_client.get_paginator('describe_db_instances')
-            for instance in instances.paginate():
-                paginated_data.extend(instance['DBInstances'])
-                
-            for RDS_Detail in paginated_data:
-                if RDS_Detail['Engine'] == 'oracle-se' or RDS_Detail['Engine'] == 'oracle-ee' or RDS_Detail['Engine'] == 'oracle-se1' or RDS_Detail['Engine'] == 'oracle-se2':
-                    rds_instance_count += 1
-        except:
-            pass
-
-    resource_count[function] = rds_instance_count
-
-def rds_postgres_instance(function, credentials, resource_count, region_list):
-    print('Scanning RDS resources')
-    rds_instance_count = 0
-
-    for region in region_list:
-        paginated_data=[]
-        try:
-            rds_client = boto3.client(service_name='rds', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            instances = rds_client.get_paginator('describe_db_instances')
-            for instance in instances.paginate():
-                paginated_data.extend(instance['DBInstances'])
-                
-            for RDS_Detail in paginated_data:
-                if RDS_Detail['Engine'] == 'postgres':
-                    rds_instance_count += 1
-        except:
-            pass
-
-    resource_count[function] = rds_instance_count
-
-def rds_sqlserver_instance(function, credentials, resource_count, region_list):
-    print('Scanning RDS resources')
-    rds_instance_count = 0
-
-    for region in region_list:
-        paginated_data=[]
-        try:
-            rds_client = boto3.client(service_name='rds', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            instances = rds_client.get_paginator('describe_db_instances')
-            for instance in instances.paginate():
-                paginated_data.extend(instance['DBInstances'])
-                
-            for RDS_Detail in paginated_data:
-                if RDS_Detail['Engine'] == 'sqlserver-ex' or RDS_Detail['Engine'] == 'sqlserver-se' or RDS_Detail['Engine'] == 'sqlserver-web' or RDS_Detail['Engine'] == 'sqlserver-ee':
-                    rds_instance_count += 1
-        except:
-            pass
-
-    resource_count[function] = rds_instance_count
-
-def rds_reserved_instance(function, credentials, resource_count, region_list):
-    print('Scanning RDS resources')
-    rds_instance_count = 0
-
-    for region in region_list:
-        try:
-            rds_client = boto3.client(service_name='rds', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            instances = rds_client.get_paginator('describe_reserved_db_instances')
-            for instance in instances.paginate():
-                rds_instance_count += len(instance['ReservedDBInstances'])
-        except:
-            pass
-
-    resource_count[function] = rds_instance_count
-
-def rds_snapshot(function, credentials, resource_count, region_list):
-    print('Scanning RDS resources')
-    rds_snapshot_count = 0
-
-    for region in region_list:
-        try:
-            rds_client = boto3.client(service_name='rds', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            rds_paginator = rds_client.get_paginator('describe_db_snapshots')
-            filters = { 'SnapshotType': 'manual'}
-            for snapshots in rds_paginator.paginate(**filters):
-                rds_snapshot_count += len(snapshots['DBSnapshots'])
-        except:
-            pass
-
-    resource_count[function] = rds_snapshot_count
-
-def redshift(function, credentials, resource_count, region_list):
-    print('Scanning Redshift resources')
-    redshift_cluster_count = 0
-
-    for region in region_list:
-        try:
-            redshift_client = boto3.client(service_name='redshift', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            clusters = redshift_client.get_paginator('describe_clusters')
-            for cluster in clusters.paginate():
-                redshift_cluster_count += len(cluster['Clusters'])
-        except:
-            pass
-
-    resource_count[function] = redshift_cluster_count
-
-def redshift_reserved(function, credentials, resource_count, region_list):
-    print('Scanning Redshift reserved resources')
-    reserved_redshift_count = 0
-
-    for region in region_list:
-        try:
-            redshift_client = boto3.client(service_name='redshift', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            redshift_paginator = redshift_client.get_paginator('describe_reserved_nodes')
-            for node in redshift_paginator.paginate():
-                reserved_redshift_count += len(node['ReservedNodes'])
-        except:
-            pass
-
-    resource_count[function] = reserved_redshift_count
-
-def route53(function, credentials, resource_count, region_list):
-    print('Scanning Route53 resources')
-    zone_count = 0
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [executor.submit(scan_collector, collector, credentials, regions, settings) for collector, regions in collector_regions.values()]
+            for future in as_completed(futures):
+                collector_count, collector_failures = future.result()
+                resource_count.update(collector_count)
+                failures.extend(collector_failures)
+    except (OSError, BrokenProcessPool):
+        print("Exception occurred while creating process. Please try again later!")
+        quit()
 
+    return resource_count, failures
+
+def run_thread_engine(credentials, units, workers):
+    resource_count = Counter()
+    failures = []
+    print("Scanning {} work units with {} workers".format(len(units), workers))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(scan_unit, credentials, collector, region) for collector, region in units]
+        for future in as_completed(futures):
+            unit_count, failure = future.result()
+            resource_count.update(unit_count)
+            if failure:
+                failures.append(failure)
+
+    return resource_count, failures
+
+# State shared by every unit of an asyncio scan
+AsyncScan = namedtuple('AsyncScan', ['session', 'clients', 'exit_stack', 'in_flight'])
+
+async def get_client_async(scan, credentials, service, region):
+    # The cache holds a task per key, so concurrent units share one client creation instead of racing to build their own
+    key = (credentials['account_id'], credentials['access_key'], service, region)
+    if key not in scan.clients:
+        client = scan.session.create_client(service, region_name=region, aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'],
+                                            aws_session_token=credentials.get('session_token'), config=CLIENT_CONFIG)
+        scan.clients[key] = asyncio.ensure_future(scan.exit_stack.enter_async_context(client))
+    client = scan.clients[key]
     try:
-        route53_client = boto3.client(service_name='route53')
-        zone_paginator = route53_client.get_paginator('list_hosted_zones')        
-        for zones in zone_paginator.paginate():
-            zone_count += len(zones['HostedZones'])
-    except:
-        pass
-
-    resource_count[function] = zone_count
-
-def route53domain(function, credentials, resource_count, region_list):
-    print('Scanning Route53 resources')
-    domain_count = 0
+        return await client
+    except Exception:
+        # Drop the failed creation so a retry builds a new client instead of awaiting the same error again
+        if scan.clients.get(key) is client:
+            del scan.clients[key]
+        raise
+
+async def fetch_pages_async(client, operation, params, in_flight, page_size=None):
+    if not client.can_paginate(operation):
+        async with in_flight:
+            page = await getattr(client, operation)(**params)
+        yield page
+        return
+
+    # Every page is a separate request, so the in-flight limit is taken per page rather than per unit
+    pages = client.get_paginator(operation).paginate(PaginationConfig=pagination_config(page_size), **params).__aiter__()
+    while True:
+        async with in_flight:
+            try:
+                page = await pages.__anext__()
+            except StopAsyncIteration:
+                return
+        yield page
+
+async def count_resources_async(scan, credentials, collector, region):
+    client = await get_client_async(scan, credentials, collector.service, region)
+    resource_count = Counter()
+    async for page in fetch_pages_async(client, collector.operation, collector.params, scan.in_flight, collector.page_size):
+        resource_count.update(count_items(collector, page))
+    return resource_count
+
+async def scan_unit_async(scan, credentials, collector, region):
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            if 'role_arn' in credentials and credentials_expiring(credentials):
+                # Assuming the role again is a blocking STS call, so it runs off the event loop
+                credentials = await asyncio.get_running_loop().run_in_executor(None, renew_credentials, credentials)
+            return await count_resources_async(scan, credentials, collector, region), None
+        except Exception as e:
+            category = classify_error(e)
+            if category is None:
+                return Counter(), None
+            if not take_retry(category, attempt):
+                return Counter(), Failure(collector.name, region, category, ' '.join(str(e).split()))
+        await asyncio.sleep(backoff_delay(attempt))
+
+async def scan_async(credentials, units, max_in_flight):
+    from aiobotocore.session import get_session as get_aio_session
+
+    print("Scanning {} work units with up to {} requests in flight".format(len(units), max_in_flight))
+
+    async with contextlib.AsyncExitStack() as exit_stack:
+        scan = AsyncScan(get_aio_session(), {}, exit_stack, asyncio.Semaphore(max_in_flight))
+        results = await asyncio.gather(*[scan_unit_async(scan, credentials, collector, region) for collector, region in units])
+
+    resource_count = Counter()
+    failures = []
+    for unit_count, failure in results:
+        resource_count.update(unit_count)
+        if failure:
+            failures.append(failure)
+    return resource_count, failures
+
+def run_asyncio_engine(credentials, units, max_in_flight):
+    if importlib.util.find_spec('aiobotocore') is None:
+        print("\033[1;31;40m ""The asyncio engine requires aiobotocore. Install using: pip install aiobotocore\n")
+        quit()
 
+    return asyncio.run(scan_async(credentials, units, max_in_flight))
+
+def run_engine(arg, credentials, units):
+    if arg.engine == 'process':
+        return run_process_engine(credentials, units, arg.processes)
+    if arg.engine == 'asyncio':
+        return run_asyncio_engine(credentials, units, arg.maxInFlight)
+    if arg.engine == 'hybrid':
+        account_units = {credentials['account_id']: (credentials, units)}
+        return run_hybrid_engine(account_units, arg.processes, arg.workers, arg.workers)[credentials['account_id']]
+    return run_thread_engine(credentials, units, arg.workers)
+
+# AWS Config resource types whose discovered counts map one to one onto a counted type. RDS and KMS are left to the API
+# collectors because Config does not split databases by engine or keys by alias, and S3 because Config records each
+# bucket in its home region while the script counts every bucket once.
+CONFIG_RESOURCE_TYPES = {
+    'AWS::ACM::Certificate': 'AWS::CertificateManager::Certificate',
+    'AWS::Lambda::Function': 'AWS::Lambda::Function',
+    'AWS::ApiGateway::RestApi': 'AWS::ApiGateway::RestApi',
+    'AWS::ApiGatewayV2::Api': 'AWS::ApiGatewayV2::Api',
+    'AWS::AutoScaling::AutoScalingGroup': 'AWS::AutoScaling::AutoScalingGroup',
+    'AWS::AutoScaling::LaunchConfiguration': 'AWS::AutoScaling::LaunchConfiguration',
+    'AWS::Backup::BackupPlan': 'AWS::Backup::BackupPlan',
+    'AWS::CloudFormation::Stack': 'AWS::CloudFormation::Stack',
+    'AWS::CloudFront::Distribution': 'AWS::CloudFront::Distribution',
+    'AWS::CloudTrail::Trail': 'AWS::CloudTrail::Trail',
+    'AWS::DynamoDB::Table': 'AWS::DynamoDB::Table',
+    'AWS::EC2::Instance': 'AWS::EC2::Instance',
+    'AWS::EC2::SecurityGroup': 'AWS::EC2::SecurityGroup',
+    'AWS::EC2::VPC': 'AWS::EC2::VPC',
+    'AWS::EC2::Subnet': 'AWS::EC2::Subnet',
+    'AWS::EC2::RouteTable': 'AWS::EC2::RouteTable',
+    'AWS::EC2::InternetGateway': 'AWS::EC2::InternetGateway',
+    'AWS::EC2::NetworkAcl': 'AWS::EC2::NetworkAcl',
+    'AWS::EC2::NetworkInterface': 'AWS::EC2::NetworkInterface',
+    'AWS::EC2::Volume': 'AWS::EC2::Volume',
+    'AWS::ECR::Repository': 'AWS::ECR::Repository',
+    'AWS::ECS::Cluster': 'AWS::ECS::Cluster',
+    'AWS::EFS::FileSystem': 'AWS::EFS::FileSystem',
+    'AWS::EKS::Cluster': 'AWS::EKS::Cluster',
+    'AWS::ElastiCache::CacheCluster': 'AWS::ElastiCache::CacheCluster',
+    'AWS::ElastiCache::ReplicationGroup': 'AWS::ElastiCache::ReplicationGroup',
+    'AWS::Elasticsearch::Domain': 'AWS::Elasticsearch::Domain',
+    'AWS::ElasticLoadBalancing::LoadBalancer': 'AWS::ElasticLoadBalancing::LoadBalancer',
+    'AWS::ElasticLoadBalancingV2::LoadBalancer': 'AWS::ElasticLoadBalancingV2::LoadBalancer',
+    'AWS::IAM::User': 'AWS::IAM::User',
+    'AWS::IAM::Group': 'AWS::IAM::Group',
+    'AWS::IAM::Role': 'AWS::IAM::Role',
+    'AWS::IAM::Policy': 'AWS::IAM::Policy',
+    'AWS::Kinesis::Stream': 'AWS::Kinesis::Stream',
+    'AWS::KinesisFirehose::DeliveryStream': 'AWS::KinesisFirehose::DeliveryStream',
+    'AWS::Redshift::Cluster': 'AWS::Redshift::Cluster',
+    'AWS::Route53::HostedZone': 'AWS::Route53::HostedZone',
+    'AWS::SNS::Topic': 'AWS::SNS::Topic',
+    'AWS::SQS::Queue': 'AWS::SQS::Queue',
+    'AWS::CloudWatch::Alarm': 'AWS::CloudWatch::Alarm',
+    'AWS::ElasticBeanstalk::Application': 'AWS::ElasticBeanstalk::Application',
+    'AWS::CodeDeploy::Application': 'AWS::CodeDeploy::Application',
+    'AWS::CodePipeline::Pipeline': 'AWS::CodePipeline::Pipeline',
+}
+
+# Global resource types are taken from GLOBAL_REGION only, since a recorder in every region may report the same resources
+CONFIG_GLOBAL_RESOURCE_TYPES = {'AWS::IAM::User', 'AWS::IAM::Group', 'AWS::IAM::Role', 'AWS::IAM::Policy',
+                                'AWS::CloudFront::Distribution', 'AWS::Route53::HostedZone'}
+CONFIG_IAM_RESOURCE_TYPES = {'AWS::IAM::User', 'AWS::IAM::Group', 'AWS::IAM::Role', 'AWS::IAM::Policy'}
+
+def get_config_recorded_types(client):
+    # A type with no discovered resources is missing from the counts, so only types an active recorder covers can be read as zero
+    recorders = client.describe_configuration_recorders().get('ConfigurationRecorders', [])
+    statuses = client.describe_configuration_recorder_status().get('ConfigurationRecordersStatus', [])
+    recording = {status['name'] for status in statuses if status.get('recording')}
+
+    recorded_types = set()
+    for recorder in recorders:
+        if recorder.get('name') not in recording:
+            continue
+        group = recorder.get('recordingGroup', {})
+        strategy = group.get('recordingStrategy', {}).get('useOnly')
+        if group.get('allSupported') or strategy == 'ALL_SUPPORTED_RESOURCE_TYPES':
+            resource_types = set(CONFIG_RESOURCE_TYPES)
+            if not group.get('includeGlobalResourceTypes'):
+                resource_types -= CONFIG_IAM_RESOURCE_TYPES
+        elif strategy == 'EXCLUSION_BY_RESOURCE_TYPES':
+            resource_types = set(CONFIG_RESOURCE_TYPES) - set(group.get('exclusionByResourceTypes', {}).get('resourceTypes', []))
+        else:
+            resource_types = set(group.get('resourceTypes', []))
+        recorded_types |= resource_types
+    return recorded_types & set(CONFIG_RESOURCE_TYPES)
+
+def count_config_region(credentials, region):
+    client = get_client(credentials, 'config', region)
+    recorded_types = get_config_recorded_types(client)
+    if region != GLOBAL_REGION:
+        recorded_types -= CONFIG_GLOBAL_RESOURCE_TYPES
+
+    resource_count = Counter()
+    params = {'limit': 100}
+    while recorded_types:
+        response = client.get_discovered_resource_counts(**params)
+        for resource in response.get('resourceCounts', []):
+            if resource['resourceType'] in recorded_types:
+                resource_count[CONFIG_RESOURCE_TYPES[resource['resourceType']]] += resource['count']
+        if not response.get('nextToken'):
+            break
+        params['nextToken'] = response['nextToken']
+    return resource_count, {CONFIG_RESOURCE_TYPES[resource_type] for resource_type in recorded_types}
+
+def count_from_config(credentials, region_list, workers):
+    # Returns the counts read from AWS Config and, per region, the counted types they cover
+    resource_count = Counter()
+    recorded_types = {}
+    print("Reading discovered resource counts from AWS Config in {} regions".format(len(region_list)))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(count_config_region, credentials, region): region for region in region_list}
+        for future in as_completed(futures):
+            region = futures[future]
+            try:
+                region_count, region_types = future.result()
+            except Exception as e:
+                print("\tAWS Config is not readable in {}, using the API collectors instead ({})".format(region, classify_error(e)))
+                continue
+            resource_count.update(region_count)
+            recorded_types[region] = region_types
+
+    return resource_count, recorded_types
+
+def is_recorded(collector, region, recorded_types, source_types):
+    return all(resource_type in source_types and resource_type in recorded_types.get(region, ()) for resource_type in collector.resource_types)
+
+def drop_recorded_units(units, source_count, recorded_types, counted_types):
+    # A unit is dropped only when the source covers every type it counts. A unit kept for its other types (the IAM
+    # summary also counts server certificates) would count the covered ones again, so those types are handed back to
+    # the API collectors everywhere and their source counts discarded, until no kept unit counts a type the source kept.
+    # A source may also cover types no collector of this scan counts (Secrets Manager, unless it is added as a Cloud Control
+    # type), and those are left out so every source reports the same types as the API collectors
+    source_types = set().union(*recorded_types.values()) & counted_types
+    while True:
+        units_left = [(collector, region) for collector, region in units if not is_recorded(collector, region, recorded_types, source_types)]
+        recounted = {resource_type for collector, region in units_left for resource_type in collector.resource_types
+                     if resource_type in source_types and resource_type in recorded_types.get(region, ())}
+        if not recounted:
+            return units_left, Counter({resource_type: total for resource_type, total in source_count.items() if resource_type in source_types})
+        source_types -= recounted
+
+# Resource Explorer resource types and the counted type each one adds to. Several load balancer types add to one key.
+RESOURCE_EXPLORER_TYPES = {
+    'lambda:function': 'AWS::Lambda::Function',
+    'cloudformation:stack': 'AWS::CloudFormation::Stack',
+    'cloudtrail:trail': 'AWS::CloudTrail::Trail',
+    'dynamodb:table': 'AWS::DynamoDB::Table',
+    'ec2:image': 'AWS::EC2::AMI',
+    'ec2:instance': 'AWS::EC2::Instance',
+    'ec2:security-group': 'AWS::EC2::SecurityGroup',
+    'ec2:vpc': 'AWS::EC2::VPC',
+    'ec2:subnet': 'AWS::EC2::Subnet',
+    'ec2:route-table': 'AWS::EC2::RouteTable',
+    'ec2:internet-gateway': 'AWS::EC2::InternetGateway',
+    'ec2:network-acl': 'AWS::EC2::NetworkAcl',
+    'ec2:network-interface': 'AWS::EC2::NetworkInterface',
+    'ec2:volume': 'AWS::EC2::Volume',
+    'ec2:snapshot': 'AWS::EC2::EBSSnapshot',
+    'ecr:repository': 'AWS::ECR::Repository',
+    'ecs:cluster': 'AWS::ECS::Cluster',
+    'elasticfilesystem:file-system': 'AWS::EFS::FileSystem',
+    'eks:cluster': 'AWS::EKS::Cluster',
+    'elasticache:cluster': 'AWS::ElastiCache::CacheCluster',
+    'elasticache:replicationgroup': 'AWS::ElastiCache::ReplicationGroup',
+    'es:domain': 'AWS::Elasticsearch::Domain',
+    'elasticloadbalancing:loadbalancer': 'AWS::ElasticLoadBalancing::LoadBalancer',
+    'elasticloadbalancing:loadbalancer/app': 'AWS::ElasticLoadBalancingV2::LoadBalancer',
+    'elasticloadbalancing:loadbalancer/net': 'AWS::ElasticLoadBalancingV2::LoadBalancer',
+    'elasticloadbalancing:loadbalancer/gwy': 'AWS::ElasticLoadBalancingV2::LoadBalancer',
+    'iam:user': 'AWS::IAM::User',
+    'iam:group': 'AWS::IAM::Group',
+    'iam:role': 'AWS::IAM::Role',
+    'iam:policy': 'AWS::IAM::Policy',
+    'kinesis:stream': 'AWS::Kinesis::Stream',
+    'firehose:deliverystream': 'AWS::KinesisFirehose::DeliveryStream',
+    'redshift:cluster': 'AWS::Redshift::Cluster',
+    's3:bucket': 'AWS::S3::Bucket',
+    'sns:topic': 'AWS::SNS::Topic',
+    'sqs:queue': 'AWS::SQS::Queue',
+    'logs:log-group': 'AWS::Logs::LogGroup',
+    'cloudwatch:alarm': 'AWS::CloudWatch::Alarm',
+    'codecommit:repository': 'AWS::CodeCommit::Repository',
+    'codepipeline:pipeline': 'AWS::CodePipeline::Pipeline',
+}
+
+# A search stops counting at 1,000 matches, and paging through its results stops at the same cap. Only the Count of
+# the response is read, so a single result is requested.
+RESOURCE_EXPLORER_MAX_RESULTS = 1
+
+def count_resource_explorer_type(client, view_arn, explorer_type):
+    # Returns None when the total is capped, so the type is counted through the API collectors instead
+    response = client.search(QueryString='resourcetype:' + explorer_type, ViewArn=view_arn, MaxResults=RESOURCE_EXPLORER_MAX_RESULTS)
+    count = response.get('Count', {})
+    return count['TotalResources'] if count.get('Complete') else None
+
+def count_from_resource_explorer(credentials, region_list, workers):
+    # Returns the counts read from the aggregator index and, per indexed region, the counted types they cover
+    resource_count = Counter()
     try:
-        domain_client = boto3.client(service_name='route53domains')
-        domain_paginator = domain_client.get_paginator('list_domains')
-        for domains in domain_paginator.paginate():
-            domain_count += len(domains['Domains'])
-    except:
-        pass
-
-    resource_count[function] = domain_count
-
-def s3bucket(function, credentials, resource_count, region_list):
-    print('Scanning S3 bucket resources')
-    s3_count = 0
+        client = get_client(credentials, 'resource-explorer-2', GLOBAL_REGION)
+        indexes = [index for page in client.get_paginator('list_indexes').paginate() for index in page.get('Indexes', [])]
+        aggregator = next((index for index in indexes if index.get('Type') == 'AGGREGATOR'), None)
+        if aggregator is None:
+            print("\tNo Resource Explorer aggregator index found, using the API collectors instead")
+            return resource_count, {}
+
+        client = get_client(credentials, 'resource-explorer-2', aggregator['Region'])
+        view_arn = client.get_default_view().get('ViewArn')
+        if not view_arn or client.get_view(ViewArn=view_arn)['View'].get('Filters', {}).get('FilterString'):
+            print("\tThe default Resource Explorer view is missing or filtered, using the API collectors instead")
+            return resource_count, {}
+    except Exception as e:
+        print("\tResource Explorer is not readable, using the API collectors instead ({})".format(classify_error(e)))
+        return resource_count, {}
+
+    print("Searching the Resource Explorer aggregator index in {}".format(aggregator['Region']))
+    covered_types = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(count_resource_explorer_type, client, view_arn, explorer_type): explorer_type for explorer_type in RESOURCE_EXPLORER_TYPES}
+        failed_types = set()
+        for future in as_completed(futures):
+            resource_type = RESOURCE_EXPLORER_TYPES[futures[future]]
+            try:
+                total = future.result()
+                if total is None:
+                    print("\tResource Explorer stopped counting {} at 1,000, using the API collectors instead".format(futures[future]))
+                    failed_types.add(resource_type)
+                    continue
+                resource_count[resource_type] += total
+                covered_types.add(resource_type)
+            except Exception as e:
+                print("\tResource Explorer search for {} failed, using the API collectors instead ({})".format(futures[future], classify_error(e)))
+                failed_types.add(resource_type)
+
+    # A key fed by several searches is only covered when all of them succeeded with a complete count. Globally counted types (IAM, S3) are
+    # only covered when every enabled region is indexed, since their collectors cannot be split by region.
+    covered_types -= failed_types
+    indexed_regions = {index['Region'] for index in indexes}
+    if not set(region_list) <= indexed_regions:
+        covered_types -= {resource_type for collector in COLLECTORS if collector.is_global for resource_type in collector.resource_types}
+    resource_count = Counter({resource_type: count for resource_type, count in resource_count.items() if resource_type in covered_types})
+    return resource_count, {region: covered_types for region in region_list if region in indexed_regions}
+
+# AWS/Usage ResourceCount metrics (Type=Resource, Class=None) keyed by their Service and Resource dimensions. A metric
+# that is not published in a region returns no datapoints, and that type is counted by its collector there instead.
+USAGE_METRIC_TYPES = {
+    ('CloudFormation', 'Stack'): 'AWS::CloudFormation::Stack',
+    ('DynamoDB', 'Table'): 'AWS::DynamoDB::Table',
+    ('ECR', 'Repository'): 'AWS::ECR::Repository',
+    ('EKS', 'Cluster'): 'AWS::EKS::Cluster',
+    ('Kinesis', 'Stream'): 'AWS::Kinesis::Stream',
+    ('Logs', 'LogGroup'): 'AWS::Logs::LogGroup',
+    ('SecretsManager', 'Secret'): 'AWS::SecretsManager::Secret',
+    ('SNS', 'Topic'): 'AWS::SNS::Topic',
+}
+
+# GetMetricData accepts up to this many queries in one request
+USAGE_METRIC_MAX_QUERIES = 500
+USAGE_METRIC_PERIOD = 300
+USAGE_METRIC_WINDOW = datetime.timedelta(hours=1)
+
+def usage_metric_query(query_id, service, resource):
+    dimensions = [{'Name': 'Service', 'Value': service}, {'Name': 'Type', 'Value': 'Resource'},
+                  {'Name': 'Resource', 'Value': resource}, {'Name': 'Class', 'Value': 'None'}]
+    return {'Id': query_id, 'ReturnData': True,
+            'MetricStat': {'Metric': {'Namespace': 'AWS/Usage', 'MetricName': 'ResourceCount', 'Dimensions': dimensions},
+                           'Period': USAGE_METRIC_PERIOD, 'Stat': 'Maximum'}}
+
+def count_usage_region(credentials, region):
+    client = get_client(credentials, 'cloudwatch', region)
+    metrics = list(USAGE_METRIC_TYPES.items())[:USAGE_METRIC_MAX_QUERIES]
+    queries = [usage_metric_query('m{}'.format(index), service, resource) for index, ((service, resource), _) in enumerate(metrics)]
+    # The window ends on the next period boundary so the period that is still filling up is included
+    now = time.time()
+    end_time = datetime.datetime.fromtimestamp(now - now % USAGE_METRIC_PERIOD + USAGE_METRIC_PERIOD, datetime.timezone.utc)
+
+    resource_count = Counter()
+    covered_types = set()
+    params = {'MetricDataQueries': queries, 'StartTime': end_time - USAGE_METRIC_WINDOW, 'EndTime': end_time, 'ScanBy': 'TimestampDescending'}
+    for page in client.get_paginator('get_metric_data').paginate(**params):
+        for result in page.get('MetricDataResults', []):
+            resource_type = metrics[int(result['Id'][1:])][1]
+            # Results are newest first, and a later page of the same query only carries older datapoints
+            if result.get('Values') and resource_type not in covered_types:
+                resource_count[resource_type] += int(result['Values'][0])
+                covered_types.add(resource_type)
+    return resource_count, covered_types
+
+def count_from_usage_metrics(credentials, region_list, workers):
+    # Returns the counts read from the usage metrics and, per region, the counted types they cover
+    resource_count = Counter()
+    covered_types = {}
+    print("Reading AWS/Usage resource count metrics in {} regions".format(len(region_list)))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(count_usage_region, credentials, region): region for region in region_list}
+        for future in as_completed(futures):
+            region = futures[future]
+            try:
+                region_count, region_types = future.result()
+            except Exception as e:
+                print("\tUsage metrics are not readable in {}, using the API collectors instead ({})".format(region, classify_error(e)))
+                continue
+            resource_count.update(region_count)
+            covered_types[region] = region_types
+
+    return resource_count, covered_types
+
+# Account level sources that count part of the scan themselves, returning their counts and the types covered per region
+ACCOUNT_SOURCES = {
+    'config': count_from_config,
+    'resource-explorer': count_from_resource_explorer,
+    'usage-metrics': count_from_usage_metrics,
+}
+
+# ARN service and resource prefix of taggable resources, and the counted type each one is. Resources whose ARN carries
+# no prefix (S3 buckets, SNS topics, SQS queues...) are keyed by an empty prefix.
+ARN_RESOURCE_TYPES = {
+    ('acm', 'certificate'): 'AWS::CertificateManager::Certificate',
+    ('lambda', 'function'): 'AWS::Lambda::Function',
+    ('apigateway', 'restapis'): 'AWS::ApiGateway::RestApi',
+    ('apigateway', 'apis'): 'AWS::ApiGatewayV2::Api',
+    ('autoscaling', 'autoScalingGroup'): 'AWS::AutoScaling::AutoScalingGroup',
+    ('backup', 'backup-plan'): 'AWS::Backup::BackupPlan',
+    ('cloudformation', 'stack'): 'AWS::CloudFormation::Stack',
+    ('cloudfront', 'distribution'): 'AWS::CloudFront::Distribution',
+    ('cloudtrail', 'trail'): 'AWS::CloudTrail::Trail',
+    ('dynamodb', 'table'): 'AWS::DynamoDB::Table',
+    ('dax', 'cache'): 'AWS::DAX::Cluster',
+    ('ec2', 'image'): 'AWS::EC2::AMI',
+    ('ec2', 'instance'): 'AWS::EC2::Instance',
+    ('ec2', 'security-group'): 'AWS::EC2::SecurityGroup',
+    ('ec2', 'vpc'): 'AWS::EC2::VPC',
+    ('ec2', 'subnet'): 'AWS::EC2::Subnet',
+    ('ec2', 'route-table'): 'AWS::EC2::RouteTable',
+    ('ec2', 'internet-gateway'): 'AWS::EC2::InternetGateway',
+    ('ec2', 'network-acl'): 'AWS::EC2::NetworkAcl',
+    ('ec2', 'placement-group'): 'AWS::EC2::PlacementGroup',
+    ('ec2', 'network-interface'): 'AWS::EC2::NetworkInterface',
+    ('ec2', 'volume'): 'AWS::EC2::Volume',
+    ('ec2', 'snapshot'): 'AWS::EC2::EBSSnapshot',
+    ('ecr', 'repository'): 'AWS::ECR::Repository',
+    ('ecs', 'cluster'): 'AWS::ECS::Cluster',
+    ('elasticfilesystem', 'file-system'): 'AWS::EFS::FileSystem',
+    ('eks', 'cluster'): 'AWS::EKS::Cluster',
+    ('elasticache', 'cluster'): 'AWS::ElastiCache::CacheCluster',
+    ('elasticache', 'replicationgroup'): 'AWS::ElastiCache::ReplicationGroup',
+    ('es', 'domain'): 'AWS::Elasticsearch::Domain',
+    ('elasticloadbalancing', 'loadbalancer'): 'AWS::ElasticLoadBalancing::LoadBalancer',
+    ('elasticloadbalancing', 'loadbalancer/app'): 'AWS::ElasticLoadBalancingV2::LoadBalancer',
+    ('elasticloadbalancing', 'loadbalancer/net'): 'AWS::ElasticLoadBalancingV2::LoadBalancer',
+    ('elasticloadbalancing', 'loadbalancer/gwy'): 'AWS::ElasticLoadBalancingV2::LoadBalancer',
+    ('fsx', 'file-system'): 'AWS::FSx::FileSystem',
+    ('elasticmapreduce', 'cluster'): 'AWS::EMR::Cluster',
+    ('kinesis', 'stream'): 'AWS::Kinesis::Stream',
+    ('firehose', 'deliverystream'): 'AWS::KinesisFirehose::DeliveryStream',
+    ('rds', 'snapshot'): 'AWS::RDS::Snapshot',
+    ('redshift', 'cluster'): 'AWS::Redshift::Cluster',
+    ('route53', 'hostedzone'): 'AWS::Route53::HostedZone',
+    ('s3', ''): 'AWS::S3::Bucket',
+    ('sns', ''): 'AWS::SNS::Topic',
+    ('sqs', ''): 'AWS::SQS::Queue',
+    ('logs', 'log-group'): 'AWS::Logs::LogGroup',
+    ('cloudwatch', 'alarm'): 'AWS::CloudWatch::Alarm',
+    ('elasticbeanstalk', 'application'): 'AWS::ElasticBeanstalk::Application',
+    ('codecommit', ''): 'AWS::CodeCommit::Repository',
+    ('codedeploy', 'application'): 'AWS::CodeDeploy::Application',
+    ('codepipeline', ''): 'AWS::CodePipeline::Pipeline',
+    ('secretsmanager', 'secret'): 'AWS::SecretsManager::Secret',
+    ('states', 'stateMachine'): 'AWS::StepFunctions::StateMachine',
+}
+
+# RDS ARNs do not carry the engine the database counts under, so tagged databases are looked up in batches of this size
+RDS_ARN_COLLECTORS = {'db': ('describe_db_instances', 'db-instance-id', 'DBInstances', classify_rds_instance),
+                      'cluster': ('describe_db_clusters', 'db-cluster-id', 'DBClusters', classify_rds_cluster)}
+RDS_FILTER_BATCH = 100
+
+TAGGING_MAX_RESULTS = 100
+
+def parse_tag_filters(tags):
+    # Key=Value pairs are ANDed across keys and ORed across the values of one key, a bare Key matches any value
+    values = {}
+    for tag in tags:
+        key, _, value = tag.partition('=')
+        values.setdefault(key, [])
+        if value:
+            values[key].append(value)
+    return [dict({'Key': key}, **({'Values': key_values} if key_values else {})) for key, key_values in values.items()]
+
+def arn_resource_type(arn):
+    _, _, service, _, _, resource = arn.split(':', 5)
+    segments = re.split('[:/]', resource.lstrip('/'))
+    # API Gateway stages and other sub-resources share their parent's prefix, so only the parent path is counted
+    if service == 'apigateway' and len(segments) != 2:
+        return None
+    if len(segments) == 1:
+        return ARN_RESOURCE_TYPES.get((service, ''))
+    return ARN_RESOURCE_TYPES.get((service, '/'.join(segments[:2]))) or ARN_RESOURCE_TYPES.get((service, segments[0]))
+
+def count_tagged_rds(credentials, region, rds_arns):
+    client = get_client(credentials, 'rds', region)
+    resource_count = Counter()
+    for prefix, arns in rds_arns.items():
+        operation, filter_name, result_key, classify = RDS_ARN_COLLECTORS[prefix]
+        for start in range(0, len(arns), RDS_FILTER_BATCH):
+            params = {'Filters': [{'Name': filter_name, 'Values': arns[start:start + RDS_FILTER_BATCH]}]}
+            for page in fetch_pages(client, operation, params):
+                resource_count.update(resource_type for resource_type in map(classify, page.get(result_key, [])) if resource_type)
+    return resource_count
+
+# The kms collector counts customer aliases rather than keys, so tagged keys are counted by the aliases pointing at them
+def count_tagged_kms(credentials, region, key_ids):
+    client = get_client(credentials, 'kms', region)
+    resource_count = Counter()
+    for page in fetch_pages(client, 'list_aliases', {}):
+        aliases = [alias for alias in page.get('Aliases', []) if alias.get('TargetKeyId') in key_ids]
+        resource_count.update(resource_type for resource_type in map(classify_kms_alias, aliases) if resource_type)
+    return resource_count
+
+def count_tagged_region(credentials, region, tag_filters, counted_types):
+    client = get_client(credentials, 'resourcegroupstaggingapi', region)
+    resource_count = Counter()
+    global_arns = set()
+    rds_arns = {}
+    kms_key_ids = set()
+    unmapped = 0
+    for page in fetch_pages(client, 'get_resources', {'TagFilters': tag_filters, 'ResourcesPerPage': TAGGING_MAX_RESULTS}):
+        for resource in page.get('ResourceTagMappingList', []):
+            arn = resource['ResourceARN']
+            _, _, service, arn_region, _, resource_path = arn.split(':', 5)
+            prefix = re.split('[:/]', resource_path)[0]
+            if service == 'rds' and prefix in RDS_ARN_COLLECTORS:
+                rds_arns.setdefault(prefix, []).append(arn)
+                continue
+            if service == 'kms' and prefix == 'key':
+                kms_key_ids.add(resource_path.split('/', 1)[1])
+                continue
+            # Resources without a region in their ARN (S3, Route 53, CloudFront) can be returned by more than one region
+            if not arn_region:
+                global_arns.add(arn)
+                continue
+            resource_type = arn_resource_type(arn)
+            if resource_type in counted_types:
+                resource_count[resource_type] += 1
+            else:
+                unmapped += 1
+    if rds_arns:
+        resource_count.update(count_tagged_rds(credentials, region, rds_arns))
+    if kms_key_ids:
+        resource_count.update(count_tagged_kms(credentials, region, kms_key_ids))
+    return resource_count, global_arns, unmapped
+
+def count_tagged(credentials, region_list, tag_filters, counted_types, workers):
+    # Only types the scan's collectors count are reported, so a tag scoped total never covers more than a full scan
+    resource_count = Counter()
+    failures = []
+    global_arns = set()
+    unmapped = 0
+    print("Counting resources tagged {} in {} regions".format(tag_filters, len(region_list)))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(count_tagged_region, credentials, region, tag_filters, counted_types): region for region in region_list}
+        for future in as_completed(futures):
+            region = futures[future]
+            try:
+                region_count, region_global_arns, region_unmapped = future.result()
+            except Exception as e:
+                failures.append(Failure('tagging', region, classify_error(e) or 'unexpected', ' '.join(str(e).split())))
+                continue
+            resource_count.update(region_count)
+            global_arns |= region_global_arns
+            unmapped += region_unmapped
+
+    for arn in global_arns:
+        resource_type = arn_resource_type(arn)
+        if resource_type in counted_types:
+            resource_count[resource_type] += 1
+        else:
+            unmapped += 1
+
+    if unmapped:
+        print("Skipped {} tagged resources of types this script does not count".format(unmapped))
+    return resource_count, failures
+
+def plan_account(arg, session, credentials, collectors):
+    # Returns the work units left for the engine, with the counts and failures of whatever was counted while planning
+    print("Collecting list of enabled region")
+    region_list = get_cached_enabled_regions(session, credentials['account_id'], arg.regionCacheFile, arg.regionCacheTtl, arg.refreshRegions)
+    counted_types = {resource_type for collector in collectors for resource_type in collector.resource_types}
+    if arg.tag:
+        resource_count, failures = count_tagged(credentials, region_list, parse_tag_filters(arg.tag), counted_types, arg.workers)
+        return [], resource_count, failures
+
+    service_regions = plan_service_regions(session, collectors, region_list)
+    skipped_units = sum(len(region_list) - len(regions) for regions in service_regions.values())
+    print("Skipping {} service and region combinations where the service is not offered".format(skipped_units))
+
+    units = build_work_units(collectors, service_regions)
+    source_count = Counter()
+    if arg.source in ACCOUNT_SOURCES:
+        source_count, recorded_types = ACCOUNT_SOURCES[arg.source](credentials, region_list, arg.workers)
+        units, source_count = drop_recorded_units(units, source_count, recorded_types, counted_types)
+    return units, source_count, []
+
+def count_account(arg, session, credentials, collectors):
+    units, source_count, failures = plan_account(arg, session, credentials, collectors)
+    resource_count, engine_failures = run_engine(arg, credentials, units)
+    resource_count.update(source_count)
+    return resource_count, failures + engine_failures
+
+# An aggregator sees every member account, so buckets are counted in their home regions and S3 is mapped as well
+AGGREGATOR_RESOURCE_TYPES = dict(CONFIG_RESOURCE_TYPES, **{'AWS::S3::Bucket': 'AWS::S3::Bucket'})
+
+AGGREGATOR_QUERY = "SELECT accountId, awsRegion, resourceType, COUNT(*) WHERE resourceType IN ({}) GROUP BY accountId, awsRegion, resourceType"
+
+def count_from_aggregator(credentials, aggregator_name, aggregator_region):
+    client = get_client(credentials, 'config', aggregator_region)
+    query = AGGREGATOR_QUERY.format(', '.join("'{}'".format(resource_type) for resource_type in sorted(AGGREGATOR_RESOURCE_TYPES)))
+    print("Querying AWS Config aggregator {} in {}".format(aggregator_name, aggregator_region))
+
+    resource_count = Counter()
+    global_count = {}
+    accounts = set()
+    regions = set()
     try:
-        resource = boto3.resource(service_name='s3')
-        s3_count = len(list(resource.buckets.all()))
-    except:
-        pass
-    
-    resource_count[function] = s3_count
-
-def ses(function, credentials, resource_count, region_list):
-    print('Scanning SES resources')
-    ses_count = 0
-
-    for region in region_list:
-        try:
-            ses_client = boto3.client(service_name='ses', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            ses_paginator = ses_client.get_paginator('list_identities')            
-            for ses in ses_paginator.paginate():
-                ses_count += len(ses['Identities'])
-        except:
-            pass
-
-    resource_count[function] = ses_count
-
-def simpledb(function, credentials, resource_count, region_list):
-    print('Scanning SimpleDb resources')
-    sdb_count = 0
-
-    for region in region_list:
-        try:
-            sdb_client = boto3.client(service_name='sdb', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            sdb_paginator = sdb_client.get_paginator('list_domains')            
-            for sdb in sdb_paginator.paginate():
-                sdb_count += len(sdb['DomainNames'])
-        except:
-            pass
-
-    resource_count[function] = sdb_count
-
-def sns(function, credentials, resource_count, region_list):
-    print('Scanning SNS resources')
-    sns_count = 0
-
-    for region in region_list:
-        try:
-            sns_resource = boto3.resource('sns', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            sns_count += len(list(sns_resource.topics.all()))
-        except:
-            pass
-
-    resource_count[function] = sns_count
-
-def sqs(function, credentials, resource_count, region_list):
-    print('Scanning SQS resources')
-    sqs_count = 0
-
-    for region in region_list:
-        try:
-            sqs_resource = boto3.resource('sqs', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            sqs_count += len(list(sqs_resource.queues.all()))
-        except:
-            pass
-
-    resource_count[function] = sqs_count
-
-def log_group(function, credentials, resource_count, region_list):
-    print('Scanning Cloudwatch log groups')
-    logs_count = 0
-
-    for region in region_list:
-        try:
-            cw_client = boto3.client(service_name='logs', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            log_paginator = cw_client.get_paginator('describe_log_groups')            
-            for log in log_paginator.paginate():
-                logs_count += len(log['logGroups'])
-        except:
-            pass
-
-    resource_count[function] = logs_count
-
-def alarms(function, credentials, resource_count, region_list):
-    print('Scanning Cloudwatch alarms')
-    alarm_count = 0
-
-    for region in region_list:
-        try:
-            cw_client = boto3.resource(service_name='cloudwatch', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            alarm_count += len(list(cw_client.alarms.all()))
-        except:
-            pass
-
-    resource_count[function] = alarm_count
-
-def organization(function, credentials, resource_count, region_list):
-    print('Scanning Organization')
-    org_count = 0
-
+        paginator = client.get_paginator('select_aggregate_resource_config')
+        for page in paginator.paginate(Expression=query, ConfigurationAggregatorName=aggregator_name, PaginationConfig={'PageSize': 100}):
+            for result in page.get('Results', []):
+                row = json.loads(result)
+                resource_type = AGGREGATOR_RESOURCE_TYPES[row['resourceType']]
+                accounts.add(row['accountId'])
+                regions.add(row['awsRegion'])
+                if row['resourceType'] in CONFIG_GLOBAL_RESOURCE_TYPES:
+                    # Each recording region reports the same global resources, so an account's largest report is its count
+                    key = (row['accountId'], resource_type)
+                    global_count[key] = max(global_count.get(key, 0), row['COUNT(*)'])
+                else:
+                    resource_count[resource_type] += row['COUNT(*)']
+    except Exception as e:
+        return resource_count, [Failure('aggregator', aggregator_region, classify_error(e) or 'unexpected', ' '.join(str(e).split()))]
+
+    for (_, resource_type), count in global_count.items():
+        resource_count[resource_type] += count
+    print("Counted {} accounts across {} regions".format(len(accounts), len(regions)))
+    print("Resource types AWS Config does not record are not counted from an aggregator")
+    return resource_count, []
+
+def list_organization_accounts(session):
+    client = session.client('organizations', region_name=GLOBAL_REGION, config=CLIENT_CONFIG)
+    return [account['Id'] for page in client.get_paginator('list_accounts').paginate()
+            for account in page['Accounts'] if account['Status'] == 'ACTIVE']
+
+def assume_account_role(session, account_id, role_name, external_id=None):
+    return assume_role(session, 'arn:aws:iam::{}:role/{}'.format(account_id, role_name), external_id)
+
+def plan_member_account(arg, session, credentials, account_id, collectors):
+    # The account the script runs as is scanned with its own credentials, it need not carry the member role
+    if account_id != credentials['account_id']:
+        credentials = assume_account_role(session, account_id, arg.roleName, arg.externalId)
+    units, source_count, failures = plan_account(arg, get_session(credentials), credentials, collectors)
+    return credentials, units, source_count, failures
+
+def run_organization_engine(account_units, workers, account_workers, report=True):
+    # Units are handed out round robin across accounts, and no account has more than account_workers units in flight,
+    # so every account progresses under the one global budget and no account is throttled by its own API rate limits
+    queues = {account_id: deque(units) for account_id, (_, units) in account_units.items() if units}
+    order = deque(queues)
+    in_flight = Counter()
+    results = {account_id: (Counter(), []) for account_id in account_units}
+    futures = {}
+    if report:
+        print("Scanning {} work units across {} accounts with {} workers".format(sum(len(queue) for queue in queues.values()), len(account_units), workers))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while order or futures:
+            for _ in range(len(order)):
+                if not order or len(futures) >= workers:
+                    break
+                account_id = order[0]
+                order.rotate(-1)
+                if in_flight[account_id] >= account_workers:
+                    continue
+                collector, region = queues[account_id].popleft()
+                futures[executor.submit(scan_unit, account_units[account_id][0], collector, region)] = account_id
+                in_flight[account_id] += 1
+                if not queues[account_id]:
+                    order.remove(account_id)
+
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                account_id = futures.pop(future)
+                in_flight[account_id] -= 1
+                unit_count, failure = future.result()
+                results[account_id][0].update(unit_count)
+                if failure:
+                    results[account_id][1].append(failure)
+
+    return results
+
+def scan_shard(account_units, workers, account_workers, settings):
+    # Shards do not print, only the parent reports progress, so the output of concurrent processes is not interleaved
+    apply_worker_settings(settings)
+    return run_organization_engine(account_units, workers, account_workers, report=False)
+
+def shard_accounts(account_units, processes):
+    # Accounts are dealt largest first to the lightest shard. A single account is dealt out unit by unit instead, so it
+    # still spreads across every process.
+    if len(account_units) == 1:
+        (account_id, (credentials, units)), = account_units.items()
+        return [{account_id: (credentials, units[index::processes])} for index in range(min(processes, len(units)))]
+
+    shards = [{} for _ in range(min(processes, len(account_units)))]
+    sizes = [0] * len(shards)
+    for account_id, (credentials, units) in sorted(account_units.items(), key=lambda x: len(x[1][1]), reverse=True):
+        lightest = sizes.index(min(sizes))
+        shards[lightest][account_id] = (credentials, units)
+        sizes[lightest] += len(units)
+    return shards
+
+def run_hybrid_engine(account_units, processes, workers, account_workers):
+    # One process per core, each running its own thread pool, so response parsing is spread across cores while the
+    # threads keep every process busy with I/O. Each process gets an equal share of the retry budget.
+    shards = shard_accounts(account_units, processes)
+    results = {account_id: (Counter(), []) for account_id in account_units}
+    if not shards:
+        return results
+    settings = worker_settings(len(shards))
+    print("Scanning {} work units across {} accounts on {} processes with {} workers each".format(
+        sum(len(units) for _, units in account_units.values()), len(account_units), len(shards), workers))
+
+    with ProcessPoolExecutor(max_workers=len(shards)) as executor:
+        futures = [executor.submit(scan_shard, shard, workers, account_workers, settings) for shard in shards]
+        for finished, future in enumerate(as_completed(futures), 1):
+            print("Finished {} of {} shards".format(finished, len(shards)))
+            for account_id, (resource_count, failures) in future.result().items():
+                results[account_id][0].update(resource_count)
+                results[account_id][1].extend(failures)
+    return results
+
+def plan_organization(arg, session, credentials, collectors):
+    # Returns the units of every account, with the counts and failures of whatever was counted while planning
+    account_ids = list_organization_accounts(session)
+    print("Found {} active accounts in the organization".format(len(account_ids)))
+
+    account_units = {}
+    account_counts = {}
+    account_failures = {}
+    with ThreadPoolExecutor(max_workers=arg.workers) as executor:
+        futures = {executor.submit(plan_member_account, arg, session, credentials, account_id, collectors): account_id for account_id in account_ids}
+        for future in as_completed(futures):
+            account_id = futures[future]
+            try:
+                account_credentials, units, source_count, failures = future.result()
+            except Exception as e:
+                account_counts[account_id] = Counter()
+                account_failures[account_id] = [Failure('assume-role', GLOBAL_REGION, classify_error(e) or 'unexpected', ' '.join(str(e).split()))]
+                continue
+            account_units[account_id] = (account_credentials, units)
+            account_counts[account_id] = source_count
+            account_failures[account_id] = failures
+    return account_units, account_counts, account_failures
+
+# Every member account describes the same organization, so these types are rolled up once rather than per account
+ORGANIZATION_WIDE_TYPES = {'AWS::Organization'}
+
+def rollup_accounts(account_counts, account_failures):
+    rollup = Counter()
+    for resource_count in account_counts.values():
+        rollup.update(resource_count)
+    for resource_type in ORGANIZATION_WIDE_TYPES:
+        if rollup[resource_type]:
+            rollup[resource_type] = max(resource_count[resource_type] for resource_count in account_counts.values())
+    failures = [failure._replace(region='{}:{}'.format(account_id, failure.region))
+                for account_id, account_failure_list in account_failures.items() for failure in account_failure_list]
+    return rollup, failures
+
+def count_organization(arg, session, credentials, collectors):
+    # Returns the organization rollup, its failures (regions prefixed with their account) and the counts of every account
+    account_units, account_counts, account_failures = plan_organization(arg, session, credentials, collectors)
+    if arg.engine == 'hybrid':
+        results = run_hybrid_engine(account_units, arg.processes, arg.workers, arg.accountWorkers)
+    else:
+        results = run_organization_engine(account_units, arg.workers, arg.accountWorkers)
+    for account_id, (resource_count, failures) in results.items():
+        account_counts[account_id].update(resource_count)
+        account_failures[account_id].extend(failures)
+
+    rollup, failures = rollup_accounts(account_counts, account_failures)
+    return rollup, failures, account_counts
+
+# A coordinator writes every (account, collector, region) unit of a scan to a SQLite queue file on storage all hosts can
+# reach. Workers on any host lease batches of units, count them with their own credentials (assuming the scan's role
+# into member accounts) and write the results back. Workers renew the leases of the units they are counting every third
+# of --leaseSeconds, so a lease only expires when its worker stopped. An expired lease is delivered again, up to
+# QUEUE_MAX_DELIVERIES times. No secrets are stored in the queue.
+QUEUE_SCHEMA = '''
+CREATE TABLE scan (role_name TEXT, external_id TEXT);
+CREATE TABLE work_items (
+    id INTEGER PRIMARY KEY,
+    account_id TEXT NOT NULL,
+    collector TEXT NOT NULL,
+    region TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    lease_owner TEXT,
+    lease_expires REAL,
+    deliveries INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    failure TEXT
+);
+CREATE INDEX work_items_status ON work_items (status, lease_expires);
+'''
+QUEUE_MAX_DELIVERIES = 3
+QUEUE_POLL_SECONDS = 5
+
+def connect_queue(queue_file):
+    # SQLite serializes writers with file locks, so the shared storage must support them (local disk, EFS, SMB)
+    connection = sqlite3.connect(queue_file, timeout=60, isolation_level=None)
+    connection.execute('PRAGMA busy_timeout = 60000')
+    return connection
+
+def find_collector(name):
+    for candidate in COLLECTORS + [count_collector for _, count_collector in COUNT_ONLY_COLLECTORS]:
+        if candidate.name == name:
+            return candidate
+    # Cloud Control collectors are named after the CloudFormation type they count
+    return cloud_control_collector(name) if '::' in name else None
+
+def enqueue_scan(arg, queue_file, account_units, account_counts, account_failures):
+    # Counts and failures from planning are stored as finished items, so the queue holds the complete scan
+    connection = connect_queue(queue_file)
+    connection.executescript('DROP TABLE IF EXISTS scan; DROP TABLE IF EXISTS work_items;' + QUEUE_SCHEMA)
+    connection.execute('BEGIN IMMEDIATE')
+    connection.execute('INSERT INTO scan VALUES (?, ?)', (arg.roleName, arg.externalId))
+    connection.executemany('INSERT INTO work_items (account_id, collector, region) VALUES (?, ?, ?)',
+                           [(account_id, collector.name, region) for account_id, (_, units) in account_units.items() for collector, region in units])
+    connection.executemany("INSERT INTO work_items (account_id, collector, region, status, result) VALUES (?, 'planning', ?, 'done', ?)",
+                           [(account_id, GLOBAL_REGION, json.dumps(resource_count)) for account_id, resource_count in account_counts.items()])
+    connection.executemany("INSERT INTO work_items (account_id, collector, region, status, failure) VALUES (?, ?, ?, 'done', ?)",
+                           [(account_id, failure.collector, failure.region, json.dumps([failure.category, failure.message]))
+                            for account_id, failures in account_failures.items() for failure in failures])
+    connection.execute('COMMIT')
+    total = connection.execute("SELECT COUNT(*) FROM work_items WHERE status = 'pending'").fetchone()[0]
+    connection.close()
+    print("Queued {} work units in {}".format(total, queue_file))
+
+def expire_leases(connection, now):
+    # Expired leases go back to pending, and items whose lease ran out too often are given up on, so one poisoned unit
+    # cannot hold the scan open forever. Runs inside the caller's transaction.
+    connection.execute("UPDATE work_items SET status = 'done', failure = ? WHERE status = 'leased' AND lease_expires < ? AND deliveries >= ?",
+                       (json.dumps(['lease-expired', 'Not completed after {} deliveries'.format(QUEUE_MAX_DELIVERIES)]), now, QUEUE_MAX_DELIVERIES))
+    connection.execute("UPDATE work_items SET status = 'pending', lease_owner = NULL, lease_expires = NULL WHERE status = 'leased' AND lease_expires < ?", (now,))
+
+def lease_work_items(connection, owner, count, lease_seconds):
+    now = time.time()
+    connection.execute('BEGIN IMMEDIATE')
     try:
-        org_client = boto3.client(service_name='organizations')
-        org_client.describe_organization()['Organization']
-        org_count = 1
-    except:
-        pass
-
-    resource_count[function] = org_count
-
-def elastic_beanstalk(function, credentials, resource_count, region_list):
-    print('Scanning Beanstalk applications')
-    eb_count = 0
-
-    for region in region_list:
-        try:
-            eb_client = boto3.client(service_name='elasticbeanstalk', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            eb_count += len(eb_client.describe_applications()['Applications'])
-        except:
-            pass
-
-    resource_count[function] = eb_count
-
-def lightsail_instance(function, credentials, resource_count, region_list):
-    print('Scanning Lightsail instances')
-    instance_count = 0
-
-    for region in region_list:
-        try:
-            lightsail_client = boto3.client(service_name='lightsail', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            ls_paginator = lightsail_client.get_paginator('get_instances')            
-            for instance in ls_paginator.paginate():
-                instance_count += len(instance['instances'])
-        except:
-            pass
-
-    resource_count[function] = instance_count
-
-def lightsail_lb(function, credentials, resource_count, region_list):
-    print('Scanning Lightsail load balancers')
-    lb_count = 0
-
-    for region in region_list:
-        try:
-            lightsail_client = boto3.client(service_name='lightsail', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            ls_paginator = lightsail_client.get_paginator('get_load_balancers')            
-            for load_balancer in ls_paginator.paginate():
-                lb_count += len(load_balancer['loadBalancers'])
-        except:
-            pass
-
-    resource_count[function] = lb_count
-
-def lightsail_rds(function, credentials, resource_count, region_list):
-    print('Scanning Lightsail RDS')
-    rds_count = 0
-
-    for region in region_list:
-        try:
-            lightsail_client = boto3.client(service_name='lightsail', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            ls_paginator = lightsail_client.get_paginator('get_relational_databases')            
-            for rds in ls_paginator.paginate():
-                rds_count += len(rds['relationalDatabases'])
-        except:
-            pass
-
-    resource_count[function] = rds_count
-
-def codecommit(function, credentials, resource_count, region_list):
-    print('Scanning CodeCommit repositories')
-    repo_count = 0
-
-    for region in region_list:
-        try:
-            codecommit_client = boto3.client(service_name='codecommit', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            cc_paginator = codecommit_client.get_paginator('list_repositories')            
-            for repository in cc_paginator.paginate():
-                repo_count += len(repository['repositories'])
-        except:
-            pass
-
-    resource_count[function] = repo_count
-
-def codedeploy(function, credentials, resource_count, region_list):
-    print('Scanning codedeploy applications')
-    app_count = 0
-
-    for region in region_list:
-        try:
-            codedeploy_client = boto3.client(service_name='codedeploy', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            cd_paginator = codedeploy_client.get_paginator('list_applications')            
-            for application in cd_paginator.paginate():
-                app_count += len(application['applications'])
-        except:
-            pass
-
-    resource_count[function] = app_count
-
-def codepipeline(function, credentials, resource_count, region_list):
-    print('Scanning codepipeline pipelines')
-    pipeline_count = 0
-
-    for region in region_list:
-        try:
-            codepipeline_client = boto3.client(service_name='codepipeline', aws_access_key_id=credentials['access_key'], aws_secret_access_key=credentials['secret_key'], region_name=region)
-            cp_paginator = codepipeline_client.get_paginator('list_pipelines')            
-            for pipeline in cp_paginator.paginate():
-                pipeline_count += len(pipeline['pipelines'])
-        except:
-            pass
-
-    resource_count[function] = pipeline_count
+        expire_leases(connection, now)
+        rows = connection.execute("SELECT id, account_id, collector, region FROM work_items WHERE status = 'pending' LIMIT ?", (count,)).fetchall()
+        connection.executemany("UPDATE work_items SET status = 'leased', lease_owner = ?, lease_expires = ?, deliveries = deliveries + 1 WHERE id = ?",
+                               [(owner, now + lease_seconds, row[0]) for row in rows])
+        connection.execute('COMMIT')
+    except Exception:
+        connection.execute('ROLLBACK')
+        raise
+    return rows
+
+def renew_leases(connection, owner, item_ids, lease_seconds):
+    # Extends only leases this worker still holds, an item that already expired and went to another worker stays there
+    connection.executemany("UPDATE work_items SET lease_expires = ? WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+                           [(time.time() + lease_seconds, item_id, owner) for item_id in item_ids])
+
+def complete_work_item(connection, owner, item_id, resource_count, failure):
+    # Only the current lease holder may complete an item, a worker whose lease expired and was re-delivered is ignored
+    connection.execute("UPDATE work_items SET status = 'done', result = ?, failure = ? WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+                       (json.dumps(resource_count), json.dumps([failure.category, failure.message]) if failure else None, item_id, owner))
+
+def queue_is_drained(connection):
+    return connection.execute("SELECT COUNT(*) FROM work_items WHERE status != 'done'").fetchone()[0] == 0
+
+def run_queue_worker(arg, session, credentials, queue_file):
+    owner = '{}:{}'.format(socket.gethostname(), os.getpid())
+    connection = connect_queue(queue_file)
+    role_name, external_id = connection.execute('SELECT role_name, external_id FROM scan').fetchone()
+    account_credentials = {credentials['account_id']: credentials}
+    completed = 0
+    print("Worker {} reading {}".format(owner, queue_file))
+
+    def credentials_for(account_id):
+        cached = account_credentials.get(account_id)
+        if cached is None or credentials_expiring(cached):
+            cached = account_credentials[account_id] = assume_account_role(session, account_id, role_name, external_id)
+        return cached
+
+    with ThreadPoolExecutor(max_workers=arg.workers) as executor:
+        while True:
+            rows = lease_work_items(connection, owner, arg.workers, arg.leaseSeconds)
+            if not rows:
+                if queue_is_drained(connection):
+                    break
+                # Units leased by other workers are still running, or may expire and come back to this one
+                time.sleep(QUEUE_POLL_SECONDS)
+                continue
+
+            futures = {}
+            for item_id, account_id, collector_name, region in rows:
+                collector = find_collector(collector_name)
+                try:
+                    if collector is None:
+                        raise ValueError('Unknown collector {}'.format(collector_name))
+                    futures[executor.submit(scan_unit, credentials_for(account_id), collector, region)] = item_id
+                except Exception as e:
+                    complete_work_item(connection, owner, item_id, {}, Failure(collector_name, region, classify_error(e) or 'unexpected', ' '.join(str(e).split())))
+            pending = set(futures)
+            while pending:
+                finished, pending = wait(pending, timeout=arg.leaseSeconds / 3, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    resource_count, failure = future.result()
+                    complete_work_item(connection, owner, futures[future], resource_count, failure)
+                    completed += 1
+                renew_leases(connection, owner, [futures[future] for future in pending], arg.leaseSeconds)
+
+    connection.close()
+    print("Worker {} completed {} work units".format(owner, completed))
+
+def collect_queue_results(queue_file, lease_seconds):
+    # Waits for the workers to drain the queue, then reads back the counts and failures of every account. The coordinator
+    # expires leases itself, and when no unit completes and no lease is held for lease_seconds, it gives up on the
+    # remaining units instead of waiting for workers that are gone.
+    connection = connect_queue(queue_file)
+    last_progress = time.time()
+    last_done = None
+    while True:
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        expire_leases(connection, now)
+        connection.execute('COMMIT')
+        done, leased, total = connection.execute("SELECT SUM(status = 'done'), SUM(status = 'leased'), COUNT(*) FROM work_items").fetchone()
+        if done == total:
+            break
+        if done != last_done or leased:
+            last_done, last_progress = done, now
+        elif now - last_progress > lease_seconds:
+            connection.execute("UPDATE work_items SET status = 'done', failure = ? WHERE status != 'done'",
+                               (json.dumps(['lease-expired', 'No worker counted this unit within {} seconds'.format(lease_seconds)]),))
+            print("No worker made progress for {} seconds, reporting {} remaining work units as incomplete".format(lease_seconds, total - done))
+            break
+        print("Waiting for workers: {} of {} work units done".format(done, total))
+        time.sleep(QUEUE_POLL_SECONDS)
+
+    account_counts = {}
+    account_failures = {}
+    for account_id, collector_name, region, result, failure in connection.execute('SELECT account_id, collector, region, result, failure FROM work_items'):
+        account_counts.setdefault(account_id, Counter()).update(json.loads(result) if result else {})
+        account_failures.setdefault(account_id, [])
+        if failure:
+            category, message = json.loads(failure)
+            account_failures[account_id].append(Failure(collector_name, region, category, message))
+    connection.close()
+    return account_counts, account_failures
+
+def count_through_queue(arg, session, credentials, collectors):
+    if arg.organization:
+        account_units, account_counts, account_failures = plan_organization(arg, session, credentials, collectors)
+    else:
+        units, source_count, failures = plan_account(arg, session, credentials, collectors)
+        account_units = {credentials['account_id']: (credentials, units)}
+        account_counts = {credentials['account_id']: source_count}
+        account_failures = {credentials['account_id']: failures}
+
+    enqueue_scan(arg, arg.coordinator, account_units, account_counts, account_failures)
+    print("Start workers on any host with: python ./count_aws_resources.py --accessKey <AWS Access Key Id> --secretKey <AWS Secret Access Key> --worker {}".format(arg.coordinator))
+    account_counts, account_failures = collect_queue_results(arg.coordinator, arg.leaseSeconds)
+    rollup, failures = rollup_accounts(account_counts, account_failures)
+    return rollup, failures, account_counts if arg.organization else {}
 
 def main(arg):
-    access_key = arg.accessKey
-    secret_key = arg.secretKey 
-
     resource_count_details = {}
-    region_list = []
+    credential_settings['cache_dir'] = arg.credentialCacheDir
 
     try :
         print("Connecting to AWS account ")
-        session = boto3.session.Session(aws_access_key_id=access_key, aws_secret_access_key=secret_key)
+        session = create_session(arg.accessKey, arg.secretKey, arg.sessionToken, arg.profile)
+        if arg.roleArn:
+            credentials = assume_role(session, arg.roleArn, arg.externalId)
+            session = get_session(credentials)
+        iam = session.client('sts')
+        account_id = iam.get_caller_identity()["Account"]
+        if not arg.roleArn:
+            credentials = session_credentials(session, account_id)
     except :
         print("\033[1;31;40m ""Please do Check for Credentials provided or Internet Connection and Try Again\n")
         quit()
 
-    iam = session.client('sts')
-    account_id = iam.get_caller_identity()["Account"]
     print("Successfully connected to AWS account", account_id)
 
     print("Counting resources across all available regions.")
     print("Wait for few minutes...\n")
 
-    function_list= [ lambdas, acm, apigateway, apigatewayv2, asg, launch_config, asg_plan, backup, cloudformation, cloudfront, cloudtrail, docdb_cluster,
-                    docdb_instance, dynamodb, dax, ec2_ami, ec2_instances, ec2_sg, vpc, subnet, route_table, igw, nacl, placement_group, network_interface,
-                    ebs, ebs_snapshots, reserved_instances, ecr, ecs, efs, eks, elasticache, replication_group, elasticsearch, elb, elbv2, fsx,
-                    iam_user, iam_group, iam_roles, iam_policy, iam_certificate, emr, kms, kinesis, firehose, neptune_cluster, neptune_instance,
-                    rds_aurora_cluster, rds_auroramysql_cluster, rds_aurorapostgres_cluster, rds_aurora_instance, rds_mariadb_instance, rds_mysql_instance,
-                    rds_oracle_instance, rds_postgres_instance, rds_sqlserver_instance, rds_reserved_instance, rds_snapshot, route53, route53domain,
-                    redshift, redshift_reserved, s3bucket, ses, simpledb, sns, sqs, log_group, alarms, organization, elastic_beanstalk, lightsail_instance,
-                    lightsail_lb, lightsail_rds, codecommit, codedeploy, codepipeline ]
+    retry_settings['max_attempts'] = arg.maxAttempts
+    retry_settings['budget'] = arg.retryBudget
+    stream_settings['enabled'] = arg.streamCounts
 
-    print("Collecting list of enabled region")
-    available_regions = session.client('ec2',region_name="us-east-1")
-    enabled_regions = available_regions.describe_regions()['Regions']
-    for region in enabled_regions:
-        region_list.append(region['RegionName'])
-    
-    manager = multiprocessing.Manager()
-    resource_count = manager.dict()
-    credentials = manager.dict()
-    credentials['access_key'] = access_key
-    credentials['secret_key'] = secret_key
-    credentials['account_id'] = account_id
-    jobs = []
-
-    for function in function_list:
-        try:
-            p = multiprocessing.Process(target=function, args=(function, credentials, resource_count, region_list))
-            jobs.append(p)
-            p.start()
-        except:
-            print("Excepyion occurred while creating process. Please try again later!")
+    counted_types = {resource_type for collector in COLLECTORS for resource_type in collector.resource_types}
+    collectors = COLLECTORS + [cloud_control_collector(type_name) for type_name in arg.cloudControlTypes if type_name not in counted_types]
+    if not arg.detail:
+        collectors = count_only_collectors(collectors)
+
+    if arg.worker:
+        run_queue_worker(arg, session, credentials, arg.worker)
+        return
+
+    account_counts = {}
+    if arg.coordinator:
+        if arg.source == 'aggregator':
+            print("\033[1;31;40m ""--coordinator cannot be combined with --source aggregator\n")
             quit()
-    
-    if jobs:
-        for process in jobs:
-            try:
-                process.join()
-            except:
-                print("Excepyion occurred while creating process. Please try again later!")
-                quit()
+        resource_count, failures, account_counts = count_through_queue(arg, session, credentials, collectors)
+    elif arg.organization:
+        if arg.engine not in ('thread', 'hybrid') or arg.source == 'aggregator':
+            print("\033[1;31;40m ""--organization runs on the thread or hybrid engine and cannot be combined with --engine {} or --source aggregator\n".format(arg.engine))
+            quit()
+        resource_count, failures, account_counts = count_organization(arg, session, credentials, collectors)
+    elif arg.source == 'aggregator':
+        if not arg.aggregatorName:
+            print("\033[1;31;40m ""Please provide the Config aggregator name with --aggregatorName\n")
+            quit()
+        resource_count, failures = count_from_aggregator(credentials, arg.aggregatorName, arg.aggregatorRegion)
+    else:
+        resource_count, failures = count_account(arg, session, credentials, collectors)
 
     print("Completed resource counting")
 
     # Updating Resource Count Object
-    resource_count_details.update({ 'AWS::Lambda::Function': resource_count[lambdas],
-                                    'AWS::CertificateManager::Certificate': resource_count[acm],
-                                    'AWS::ApiGateway::RestApi': resource_count[apigateway],
-                                    'AWS::ApiGatewayV2::Api': resource_count[apigatewayv2],
-                                    'AWS::AutoScaling::AutoScalingGroup': resource_count[asg],
-                                    'AWS::AutoScaling::LaunchConfiguration': resource_count[launch_config],
-                                    'AWS::AutoScalingPlans::ScalingPlan': resource_count[asg_plan],
-                                    'AWS::Backup::BackupPlan': resource_count[backup],
-                                    'AWS::CloudFormation::Stack': resource_count[cloudformation],
-                                    'AWS::CloudFront::Distribution': resource_count[cloudfront],
-                                    'AWS::CloudTrail::Trail': resource_count[cloudtrail],
-                                    'AWS::DocDB::DBCluster': resource_count[docdb_cluster],
-                                    'AWS::DocDB::DBInstance': resource_count[docdb_instance],
-                                    'AWS::DynamoDB::Table': resource_count[dynamodb],
-                                    'AWS::DAX::Cluster': resource_count[dax],
-                                    'AWS::EC2::AMI': resource_count[ec2_ami],
-                                    'AWS::EC2::Instance': resource_count[ec2_instances],
-                                    'AWS::EC2::SecurityGroup': resource_count[ec2_sg],
-                                    'AWS::EC2::VPC': resource_count[vpc],
-                                    'AWS::EC2::Subnet': resource_count[subnet],
-                                    'AWS::EC2::RouteTable': resource_count[route_table],
-                                    'AWS::EC2::InternetGateway': resource_count[igw],
-                                    'AWS::EC2::NetworkAcl': resource_count[nacl],
-                                    'AWS::EC2::PlacementGroup': resource_count[placement_group],
-                                    'AWS::EC2::NetworkInterface': resource_count[network_interface],
-                                    'AWS::EC2::Volume': resource_count[ebs],
-                                    'AWS::EC2::EBSSnapshot': resource_count[ebs_snapshots],
-                                    'AWS::EC2::CapacityReservation': resource_count[reserved_instances],
-                                    'AWS::ECR::Repository': resource_count[ecr],
-                                    'AWS::ECS::Cluster': resource_count[ecs],
-                                    'AWS::EFS::FileSystem': resource_count[efs],
-                                    'AWS::EKS::Cluster': resource_count[eks],
-                                    'AWS::ElastiCache::CacheCluster': resource_count[elasticache],
-                                    'AWS::ElastiCache::ReplicationGroup': resource_count[replication_group],
-                                    'AWS::Elasticsearch::Domain': resource_count[elasticsearch],
-                                    'AWS::ElasticLoadBalancing::LoadBalancer': resource_count[elb],
-                                    'AWS::ElasticLoadBalancingV2::LoadBalancer': resource_count[elbv2],
-                                    'AWS::FSx::FileSystem': resource_count[fsx],
-                                    'AWS::IAM::User': resource_count[iam_user],
-                                    'AWS::IAM::Group': resource_count[iam_group],
-                                    'AWS::IAM::Role': resource_count[iam_roles],
-                                    'AWS::IAM::Policy': resource_count[iam_policy],
-                                    'AWS::IAM::ServerCertificate': resource_count[iam_certificate],
-                                    'AWS::EMR::Cluster': resource_count[emr],
-                                    'AWS::KMS::Key': resource_count[kms],
-                                    'AWS::Kinesis::Stream': resource_count[kinesis],
-                                    'AWS::KinesisFirehose::DeliveryStream': resource_count[firehose],
-                                    'AWS::Neptune::DBCluster': resource_count[neptune_cluster],
-                                    'AWS::Neptune::DBInstance': resource_count[neptune_instance],
-                                    'AWS::RDS::DBCluster::Aurora': resource_count[rds_aurora_cluster],
-                                    'AWS::RDS::DBCluster::AuroraMySql': resource_count[rds_auroramysql_cluster],
-                                    'AWS::RDS::DBCluster::AuroraPostgres': resource_count[rds_aurorapostgres_cluster],
-                                    'AWS::RDS::DBInstance::Aurora': resource_count[rds_aurora_instance],
-                                    'AWS::RDS::DBInstance::MariaDB': resource_count[rds_mariadb_instance],
-                                    'AWS::RDS::DBInstance::MySql': resource_count[rds_mysql_instance],
-                                    'AWS::RDS::DBInstance::Oracle': resource_count[rds_oracle_instance],
-                                    'AWS::RDS::DBInstance::Postgres': resource_count[rds_postgres_instance],
-                                    'AWS::RDS::DBInstance::SQLServer': resource_count[rds_sqlserver_instance],
-                                    'AWS::RDS::ReservedInstance': resource_count[rds_reserved_instance],
-                                    'AWS::RDS::Snapshot': resource_count[rds_snapshot],
-                                    'AWS::Redshift::Cluster': resource_count[redshift],
-                                    'AWS::Redshift::ReservedNode': resource_count[redshift_reserved],
-                                    'AWS::Route53::HostedZone': resource_count[route53],
-                                    'AWS::Route53::Domain': resource_count[route53domain],
-                                    'AWS::S3::Bucket': resource_count[s3bucket],
-                                    'AWS::SES': resource_count[ses],
-                                    'AWS::SDB::Domain': resource_count[simpledb],
-                                    'AWS::SNS::Topic': resource_count[sns],
-                                    'AWS::SQS::Queue': resource_count[sqs],
-                                    'AWS::Logs::LogGroup': resource_count[log_group],
-                                    'AWS::CloudWatch::Alarm': resource_count[alarms],
-                                    'AWS::Organization': resource_count[organization],
-                                    'AWS::ElasticBeanstalk::Application': resource_count[elastic_beanstalk],
-                                    'AWS::Lightsail::Instance': resource_count[lightsail_instance],
-                                    'AWS::Lightsail::LoadBalancer': resource_count[lightsail_lb],
-                                    'AWS::Lightsail::RDS': resource_count[lightsail_rds],
-                                    'AWS::CodeCommit::Repository': resource_count[codecommit],
-                                    'AWS::CodeDeploy::Application': resource_count[codedeploy],
-                                    'AWS::CodePipeline::Pipeline': resource_count[codepipeline]
-                                    })
+    for collector in collectors:
+        for resource_type in collector.resource_types:
+            resource_count_details[resource_type] = resource_count.get(resource_type, 0)
 
     # Processing Workloads
     workload_count = 0
@@ -1409,9 +1887,27 @@ def main(arg):
             print("\t{} : {}".format(key, value))
             resource_count+=value
 
+    # Showing every account of an organization scan
+    if account_counts:
+        print("\nAccount Distribution:")
+        for account, count in sorted(account_counts.items(), key=lambda x: sum(x[1].values()), reverse=True):
+            print("\t{} : {}".format(account, sum(count.values())))
+            for key, value in sorted(count.items(), key=lambda x: x[1], reverse=True):
+                if value != 0:
+                    print("\t\t{} : {}".format(key, value))
+
+    # Showing regions that could not be counted, so a partial count is never mistaken for a complete one
+    if failures:
+        print("\nIncomplete Scans:")
+        for failure in sorted(failures, key=lambda x: (x.category, x.collector, x.region)):
+            print("\t{} in {} : {} ({})".format(failure.collector, failure.region, failure.category, failure.message))
+
     print("\n\nSummary:")
     print("\tZscaler CSPM Supported Total Workloads:", workload_count)
     print("\tTotal Resources:", resource_count)
+    if failures:
+        for category, count in sorted(Counter(failure.category for failure in failures).items()):
+            print("\tIncomplete Scans ({}): {}".format(category, count))
 
 
 if(__name__ == '__main__'):
@@ -1422,13 +1918,114 @@ if(__name__ == '__main__'):
     # Add the arguments
     arg_parser.add_argument('--accessKey',
                         type=str,
-                        required=True,
-                        help='AWS Access Key')
+                        help='AWS Access Key, the default credential chain is used when neither keys nor --profile are given')
     arg_parser.add_argument('--secretKey',
                         type=str,
-                        required=True,
                         help='AWS Secret Key')
+    arg_parser.add_argument('--sessionToken',
+                        type=str,
+                        help='AWS Session Token, for temporary access keys')
+    arg_parser.add_argument('--profile',
+                        type=str,
+                        help='Named profile from the AWS shared config and credentials files')
+    arg_parser.add_argument('--roleArn',
+                        type=str,
+                        help='Role to assume with the given credentials before counting; the account of the role is counted')
+    arg_parser.add_argument('--credentialCacheDir',
+                        type=str,
+                        default=CREDENTIAL_CACHE_DIR,
+                        help='Directory that caches assumed role credentials until shortly before they expire, empty disables the cache')
+    arg_parser.add_argument('--organization',
+                        action='store_true',
+                        help='Count every active account of the AWS Organization the credentials belong to, by assuming --roleName in each member account')
+    arg_parser.add_argument('--roleName',
+                        type=str,
+                        default='OrganizationAccountAccessRole',
+                        help='Role assumed in each member account by --organization')
+    arg_parser.add_argument('--externalId',
+                        type=str,
+                        help='External id passed when assuming --roleArn or --roleName, if the role requires one')
+    arg_parser.add_argument('--accountWorkers',
+                        type=int,
+                        default=8,
+                        help='Maximum number of concurrent work units per account in an --organization scan')
+    arg_parser.add_argument('--coordinator',
+                        type=str,
+                        help='Plan the scan into this SQLite queue file, wait for --worker processes to count it and report the result')
+    arg_parser.add_argument('--worker',
+                        type=str,
+                        help='Count work units leased from the SQLite queue file of a --coordinator until it is drained')
+    arg_parser.add_argument('--leaseSeconds',
+                        type=int,
+                        default=900,
+                        help='Seconds a leased work unit may go without a heartbeat from its worker before it is delivered to another worker; the coordinator gives up after as long without progress')
+    arg_parser.add_argument('--source',
+                        type=str,
+                        choices=['api', 'config', 'resource-explorer', 'usage-metrics', 'aggregator'],
+                        default='api',
+                        help='Where counts come from: the service APIs, AWS Config discovered resource counts, a Resource Explorer aggregator index or CloudWatch usage metrics with the APIs covering anything they do not, or an organization wide AWS Config aggregator')
+    arg_parser.add_argument('--aggregatorName',
+                        type=str,
+                        help='Name of the AWS Config aggregator queried by --source aggregator')
+    arg_parser.add_argument('--aggregatorRegion',
+                        type=str,
+                        default=GLOBAL_REGION,
+                        help='Region the AWS Config aggregator was created in')
+    arg_parser.add_argument('--engine',
+                        type=str,
+                        choices=['thread', 'hybrid', 'asyncio', 'process'],
+                        default='thread',
+                        help='Scan engine: a bounded thread pool over (collector, region) work units, one such thread pool per process with accounts sharded across processes, a single asyncio event loop, or a process pool scanning one collector per task')
+    arg_parser.add_argument('--processes',
+                        type=int,
+                        default=os.cpu_count() or 1,
+                        help='Number of worker processes for the hybrid and process engines, one per core by default')
+    arg_parser.add_argument('--workers',
+                        type=int,
+                        default=32,
+                        help='Number of concurrent work units for the thread engine, or per process for the hybrid engine')
+    arg_parser.add_argument('--maxInFlight',
+                        type=int,
+                        default=200,
+                        help='Maximum number of AWS requests in flight for the asyncio engine')
+    arg_parser.add_argument('--tag',
+                        type=str,
+                        action='append',
+                        default=[],
+                        help='Only count resources carrying this Key=Value tag, read from the Resource Groups Tagging API. Can be repeated')
+    arg_parser.add_argument('--cloudControlTypes',
+                        type=str,
+                        nargs='+',
+                        default=[],
+                        help='Additional CloudFormation resource types to count through the Cloud Control API, for example AWS::Glue::Job')
+    arg_parser.add_argument('--detail',
+                        action='store_true',
+                        help='List every item instead of reading totals from single call count sources such as the IAM account summary')
+    arg_parser.add_argument('--streamCounts',
+                        action='store_true',
+                        help='Count the items of EC2, ELB, RDS and other XML API responses while streaming them, without parsing every item')
+    arg_parser.add_argument('--maxAttempts',
+                        type=int,
+                        default=3,
+                        help='Attempts per work unit when it is throttled or its endpoint is unavailable')
+    arg_parser.add_argument('--retryBudget',
+                        type=int,
+                        default=200,
+                        help='Total number of work unit retries allowed across the whole scan')
+    arg_parser.add_argument('--regionCacheFile',
+                        type=str,
+                        default=REGION_CACHE_FILE,
+                        help='File that caches the enabled regions of each account')
+    arg_parser.add_argument('--regionCacheTtl',
+                        type=int,
+                        default=86400,
+                        help='Seconds for which cached enabled regions are reused, 0 disables the cache')
+    arg_parser.add_argument('--refreshRegions',
+                        action='store_true',
+                        help='Discover enabled regions again and refresh the cache')
 
     # Execute the parse_args() method
     args = arg_parser.parse_args()
+    if bool(args.accessKey) != bool(args.secretKey):
+        arg_parser.error('--accessKey and --secretKey must be given together')
     main(args)
@@ -23,25 +23,57 @@ SYNOPSIS
 
 .INPUTS
     cspmRoleARM : ARN of the IAM Role that was created during Account onboarding on CSPM.
+    regionCacheTtl : (Optional) Seconds for which the enabled regions found by a previous run are reused. Defaults to one day, 0 disables the cache.
+    refreshRegions : (Optional) Probe the enabled regions again and refresh the cache.
 
 .OUTPUTS
     None
 '''
 
+import os
+import time
 import argparse
 import boto3
 import json
 
-def getAllRegions(servicename):
+# Enabled regions are cached per account, so repeated runs skip probing every region
+regionCacheFile = os.path.join(os.path.expanduser('~'), '.cache', 'updateKmsKeyAccessPolicy', 'regions.json')
+
+def loadRegionCache():
+    try:
+        with open(regionCacheFile) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def saveRegionCache(regionCache):
+    try:
+        os.makedirs(os.path.dirname(regionCacheFile), exist_ok=True)
+        tempFile = '{}.{}.tmp'.format(regionCacheFile, os.getpid())
+        with open(tempFile, 'w') as f:
+            json.dump(regionCache, f)
+        os.replace(tempFile, regionCacheFile)
+    except OSError:
+        print("Unable to write region cache to " + regionCacheFile)
+
+def getAllRegions(servicename, cacheTtl=86400, refresh=False):
     regions=[]
     enabled_regions = []
 
     try:
         session = boto3.session.Session()
+        accountId = session.client('sts', region_name='us-east-1').get_caller_identity()['Account']
     except:
         print("Unable to create boto3 session. Try again later with appropriate permissions!")
         return
 
+    cacheKey = accountId + ':' + servicename
+    regionCache = loadRegionCache()
+    cached = regionCache.get(cacheKey)
+    if cached and not refresh and time.time() - cached['updated'] < cacheTtl:
+        print("Using enabled regions cached at " + time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(cached['updated'])))
+        return cached['regions']
+
     regions = session.get_available_regions(servicename)
     
     for region in regions:
@@ -51,6 +83,10 @@ def getAllRegions(servicename):
             enabled_regions.append(region)
         except:
             pass
+
+    if cacheTtl > 0 and enabled_regions:
+        regionCache[cacheKey] = {'regions': enabled_regions, 'updated': time.time()}
+        saveRegionCache(regionCache)
             
     return enabled_regions
 
@@ -59,7 +95,9 @@ def main(arg):
 
     print("Initiating Key Policy update for all KMS Keys in the AWS Account\n")
     cspmPolicyJson = {"Sid": "Allow Read Access to Key","Effect": "Allow","Principal": {"AWS": str(cspmRoleArn)},"Action": ["kms:DescribeKey", "kms:ListResourceTags","kms:ListKeyPolicies","kms:GetKeyPolicy","kms:GetKeyRotationStatus"],"Resource": "*"}
-    regions = getAllRegions('kms')
+    regions = getAllRegions('kms', arg.regionCacheTtl, arg.refreshRegions)
+    if regions is None:
+        return
     print("Listing all keys in the following regions: "+str(regions)+"\n")
     
     for region in regions:
@@ -119,6 +157,13 @@ if(__name__ == '__main__'):
                             type=str,
                             required=True,
                             help='CSPM Data Collector Role ARN')
+    arg_parser.add_argument('--regionCacheTtl',
+                            type=int,
+                            default=86400,
+                            help='Seconds for which cached enabled regions are reused, 0 disables the cache')
+    arg_parser.add_argument('--refreshRegions',
+                            action='store_true',
+                            help='Probe enabled regions again and refresh the cache')
 
     args = arg_parser.parse_args()
     main(args)